@@ -0,0 +1,149 @@
+"""
+Cost-aware admission control for /api/analyze.
+
+A request is priced at num_copies x estimated tokens (prompt tokens plus the
+tokens generated per copy), which is roughly what it costs the target model.
+Each client has a token bucket that refills at a steady rate, and the process
+as a whole has an in-flight budget. Requests that do not fit are rejected with
+a Retry-After hint instead of queueing behind everyone else.
+
+State is kept in-process, so limits apply per server process.
+"""
+
+import math
+import threading
+import time
+
+# Rough characters-per-token ratio for English text with Llama-style tokenizers
+CHARS_PER_TOKEN = 4
+
+class AdmissionRejected(Exception):
+
+    """Raised when a request does not fit the client's bucket or the global budget."""
+
+    def __init__(self, reason, retry_after):
+        super(AdmissionRejected, self).__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class RequestTooExpensive(Exception):
+
+    """Raised when a single request costs more than a bucket can ever hold."""
+
+class TokenBucket:
+
+    """Token bucket refilled continuously at `refill_rate` tokens per second."""
+
+    def __init__(self, capacity, refill_rate, now):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.updated = now
+
+    def wait_time(self, cost):
+        """Seconds until `cost` tokens are available (0 if they are now)."""
+        deficit = cost - self.tokens
+        return 0.0 if deficit <= 0 else deficit / self.refill_rate
+
+class AdmissionTicket:
+
+    """Releases the request's share of the in-flight budget when closed."""
+
+    def __init__(self, controller, cost):
+        self.controller = controller
+        self.cost = cost
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self.cost)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class AdmissionController:
+
+    """Per-client token buckets plus a global in-flight cost budget."""
+
+    def __init__(
+        self,
+        bucket_capacity=50000,
+        refill_rate=1000,
+        max_inflight_cost=200000,
+        inflight_retry_after=1.0,
+        max_buckets=10000
+    ):
+        self.bucket_capacity = bucket_capacity
+        self.refill_rate = refill_rate
+        self.max_inflight_cost = max_inflight_cost
+        self.inflight_retry_after = inflight_retry_after
+        self.max_buckets = max_buckets
+
+        self.inflight_cost = 0
+        self.admitted = 0
+        self.rejected = 0
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def estimate_cost(num_copies, prompt, max_new_tokens=100):
+        """Price a request as num_copies x (prompt tokens + generated tokens)."""
+        prompt_tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+        return num_copies * (prompt_tokens + max_new_tokens)
+
+    def admit(self, key, cost):
+        """Reserve `cost` for client `key` or raise AdmissionRejected.
+
+        Returns an AdmissionTicket to be released when the request finishes.
+        """
+        if cost > self.bucket_capacity or cost > self.max_inflight_cost:
+            raise RequestTooExpensive(
+                f"Request cost {cost} exceeds the per-request limit of "
+                f"{min(self.bucket_capacity, self.max_inflight_cost)}"
+            )
+
+        now = time.monotonic()
+        with self._lock:
+            if self.inflight_cost + cost > self.max_inflight_cost:
+                self.rejected += 1
+                raise AdmissionRejected('Server is at capacity', self.inflight_retry_after)
+
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                bucket = self._buckets[key] = TokenBucket(
+                    self.bucket_capacity, self.refill_rate, now
+                )
+            bucket.refill(now)
+            wait = bucket.wait_time(cost)
+            if wait > 0:
+                self.rejected += 1
+                raise AdmissionRejected('Rate limit exceeded', wait)
+
+            bucket.tokens -= cost
+            self.inflight_cost += cost
+            self.admitted += 1
+        return AdmissionTicket(self, cost)
+
+    def _release(self, cost):
+        with self._lock:
+            self.inflight_cost -= cost
+
+    def _prune(self, now):
+        # A bucket that has refilled to capacity is indistinguishable from a new one
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[key]
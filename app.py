@@ -1,11 +1,24 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, g
 import os
+import io
+import functools
+import csv
 import json
+import zlib
+import math
+import time
 import sqlite3
 from datetime import datetime
-import hashlib
 import secrets
 
+from history_writer import HistoryWriter
+from passwords import hash_password, verify_password, needs_rehash, dummy_password_hash
+from admission import AdmissionController, AdmissionRejected, RequestTooExpensive
+from coalescing import SingleFlight, request_key
+from lib.cascade import CascadeRouter, contains_keyword
+from lib.daemon_client import DaemonClient
+import lib.metrics as metrics
+import lib.profiling as profiling
 
 
 app = Flask(__name__)
@@ -33,6 +46,94 @@ except Exception:
 # Allow overriding the database path via env var for Railway volumes
 DATABASE = os.environ.get('DATABASE', os.path.join(os.path.dirname(__file__), 'smoothllm.db'))
 
+# Rows fetched per cursor round-trip and bytes buffered per chunk when streaming exports
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 500))
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+# Prompt history is written behind the request by a background thread
+history_writer = HistoryWriter(
+    DATABASE,
+    batch_size=int(os.environ.get('HISTORY_FLUSH_SIZE', 100)),
+    flush_interval=float(os.environ.get('HISTORY_FLUSH_INTERVAL', 0.5))
+)
+
+# Per-request traces are written here when ENABLE_TRACE_HEADER is set and a
+# request carries the X-SmoothLLM-Trace header
+ENABLE_TRACE_HEADER = os.environ.get('ENABLE_TRACE_HEADER', '').lower() in ('1', 'true', 'yes')
+TRACE_DIR = os.environ.get('TRACE_DIR', os.path.join(os.path.dirname(__file__), 'traces'))
+
+# Admission control for /api/analyze; costs are in estimated model tokens
+MAX_NUM_COPIES = int(os.environ.get('MAX_NUM_COPIES', 100))
+admission = AdmissionController(
+    bucket_capacity=int(os.environ.get('ADMISSION_BUCKET_CAPACITY', 50000)),
+    refill_rate=float(os.environ.get('ADMISSION_REFILL_RATE', 1000)),
+    max_inflight_cost=int(os.environ.get('ADMISSION_MAX_INFLIGHT', 200000))
+)
+
+# Concurrent identical analyze requests share one evaluation within this
+# process. COALESCE_ACROSS_WORKERS also coordinates server processes through
+# the inflight_analyses table, at the cost of SQLite commits on every request
+COALESCE_REQUESTS = os.environ.get('COALESCE_REQUESTS', '1').lower() in ('1', 'true', 'yes')
+COALESCE_ACROSS_WORKERS = os.environ.get('COALESCE_ACROSS_WORKERS', '').lower() in ('1', 'true', 'yes')
+analysis_flight = SingleFlight(
+    DATABASE if COALESCE_ACROSS_WORKERS else None,
+    lease_seconds=float(os.environ.get('COALESCE_LEASE_SECONDS', 300))
+) if COALESCE_REQUESTS else None
+
+# Cascade mode: a keyword score routes each prompt before admission, so
+# plainly benign prompts get CASCADE_BENIGN_COPIES copies (none by default),
+# borderline ones CASCADE_BORDERLINE_COPIES (default: all) and harmful ones
+# the full smoothllm_num_copies vote
+CASCADE_ENABLED = os.environ.get('CASCADE_ENABLED', '').lower() in ('1', 'true', 'yes')
+CASCADE_BORDERLINE_COPIES = os.environ.get('CASCADE_BORDERLINE_COPIES')
+cascade_router = CascadeRouter(
+    benign_threshold=float(os.environ.get('CASCADE_BENIGN_THRESHOLD', 0.5)),
+    harmful_threshold=float(os.environ.get('CASCADE_HARMFUL_THRESHOLD', 1.0)),
+    benign_copies=int(os.environ.get('CASCADE_BENIGN_COPIES', 0)),
+    borderline_copies=int(CASCADE_BORDERLINE_COPIES) if CASCADE_BORDERLINE_COPIES else None
+)
+
+# When SMOOTHLLM_DAEMON_SOCKET is set, analyses run on the models held by
+# smoothllm_daemon.py instead of the mock heuristic
+SMOOTHLLM_DAEMON_SOCKET = os.environ.get('SMOOTHLLM_DAEMON_SOCKET')
+daemon_client = DaemonClient(
+    SMOOTHLLM_DAEMON_SOCKET,
+    timeout=float(os.environ.get('SMOOTHLLM_DAEMON_TIMEOUT', 300))
+) if SMOOTHLLM_DAEMON_SOCKET else None
+# Models clients may request; the daemon enforces its own allowlist as well
+SMOOTHLLM_ALLOWED_MODELS = [
+    name.strip() for name in os.environ.get('SMOOTHLLM_ALLOWED_MODELS', 'tinyllama').split(',') if name.strip()
+]
+
+# Metrics exposed on /metrics
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by route',
+    ['route', 'method', 'status']
+)
+SQLITE_QUERY_SECONDS = metrics.histogram(
+    'sqlite_query_seconds',
+    'SQLite statement execution time by statement type',
+    ['operation']
+)
+ADMISSION_DECISIONS = metrics.counter(
+    'admission_decisions',
+    'Admission control decisions for /api/analyze',
+    ['decision']
+)
+metrics.gauge(
+    'history_queue_depth',
+    'Prompt history rows waiting for the background writer'
+).set_function(lambda: history_writer.queue_depth)
+metrics.gauge(
+    'admission_inflight_cost',
+    'Estimated token cost of analyze requests currently running'
+).set_function(lambda: admission.inflight_cost)
+metrics.gauge(
+    'singleflight_inflight',
+    'Distinct analyze evaluations this process is running or waiting on'
+).set_function(lambda: analysis_flight.inflight if analysis_flight is not None else 0)
+
 def init_db():
     """Initialize the database with required tables."""
     conn = sqlite3.connect(DATABASE)
@@ -68,19 +169,36 @@ def init_db():
     conn.commit()
     conn.close()
 
+class TimedConnection(sqlite3.Connection):
+
+    """SQLite connection that records statement execution times."""
+
+    def execute(self, sql, parameters=()):
+        operation = sql.lstrip().split(None, 1)[0].upper()
+        with SQLITE_QUERY_SECONDS.time(operation=operation):
+            return super(TimedConnection, self).execute(sql, parameters)
+
 def get_db_connection():
     """Get database connection."""
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(DATABASE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
-def hash_password(password):
-    """Hash password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
 
-def verify_password(password, password_hash):
-    """Verify password against hash."""
-    return hash_password(password) == password_hash
+@app.after_request
+def record_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            route=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
 
 # Model loading disabled for Netlify deployment
 # Using mock analysis instead
@@ -94,9 +212,15 @@ def index():
 def health():
     """Simple health check for Railway."""
     return jsonify({
-        'status': 'ok'
+        'status': 'ok',
+        'history_queue_depth': history_writer.queue_depth
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose metrics in the Prometheus text exposition format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/signin')
 def signin():
     """Render the sign-in page."""
@@ -115,64 +239,236 @@ def profile():
 @app.route('/api/analyze', methods=['POST'])
 def analyze_prompt():
     """Analyze a prompt using SmoothLLM."""
+    payload, status, headers = handle_analyze(
+        request.get_json(silent=True),
+        user_id=session.get('user_id'),
+        client_key=admission_key(session.get('user_id'), request.remote_addr),
+        trace=trace_requested(request.headers)
+    )
+    return jsonify(payload), status, headers
+
+def admission_key(user_id, remote_addr):
+    """Rate-limit signed-in users per account and anonymous clients per address."""
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"addr:{remote_addr}"
+
+def trace_requested(headers):
+    """True if tracing is enabled and the request asked for a trace."""
+    return ENABLE_TRACE_HEADER and headers.get('X-SmoothLLM-Trace', '') not in ('', '0')
+
+def handle_analyze(data, user_id=None, client_key=None, trace=False, prepared=None):
+    """Shared implementation of /api/analyze for the WSGI and ASGI servers.
+
+    `prepared` is the AnalyzeRequest from prepare_analysis() when the caller
+    already validated (and possibly admitted) the request; otherwise `data`
+    is prepared here.
+
+    When `trace` is set the evaluation is recorded as a Chrome trace under
+    TRACE_DIR and the file name is returned in the X-SmoothLLM-Trace-File header.
+
+    Returns a (payload, status, headers) tuple.
+    """
+    if not trace:
+        return _handle_analyze(data, user_id, client_key, prepared)
+
+    tracer = profiling.Tracer(name='api-analyze')
+    with tracer.activate(), tracer.span('api.analyze'):
+        payload, status, headers = _handle_analyze(data, user_id, client_key, prepared)
+    trace_file = f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}.json"
+    tracer.save(os.path.join(TRACE_DIR, trace_file))
+    return payload, status, dict(headers, **{'X-SmoothLLM-Trace-File': trace_file})
+
+class AnalyzeRequest:
+
+    """A validated and routed /api/analyze request."""
+
+    __slots__ = ('prompt', 'num_copies', 'pert_type', 'pert_pct', 'target_model_name', 'route', 'ticket')
+
+    def __init__(self, prompt, num_copies, pert_type, pert_pct, target_model_name, route=None):
+        self.prompt = prompt
+        self.num_copies = num_copies
+        self.pert_type = pert_type
+        self.pert_pct = pert_pct
+        self.target_model_name = target_model_name
+        self.route = route
+        # Admission ticket when the server reserved the cost before queueing the request
+        self.ticket = None
+
+    def key(self):
+        """Coalescing key; the client is not part of it."""
+        return request_key(self.prompt, self.num_copies, self.pert_type, self.pert_pct, self.target_model_name)
+
+def prepare_analysis(data):
+    """Validate and route an analyze request without running it.
+
+    Returns (AnalyzeRequest, None), or (None, (payload, status, headers)) for
+    a rejected request.
+    """
+    data = data or {}
+    
+    # Extract parameters
+    prompt = data.get('prompt', '').strip()
+    num_copies = data.get('smoothllm_num_copies', 10)
+    pert_type = data.get('smoothllm_pert_type', 'RandomPatchPerturbation')
+    pert_pct = data.get('smoothllm_pert_pct', 10)
+    target_model_name = data.get('target_model', 'tinyllama')
+    
+    if not prompt:
+        return None, ({'error': 'Prompt is required'}, 400, {})
+    if target_model_name not in SMOOTHLLM_ALLOWED_MODELS:
+        return None, ({'error': f"target_model must be one of: {', '.join(SMOOTHLLM_ALLOWED_MODELS)}"}, 400, {})
+    
     try:
-        data = request.get_json()
-        
-        # Extract parameters
-        prompt = data.get('prompt', '').strip()
-        num_copies = data.get('smoothllm_num_copies', 10)
-        pert_type = data.get('smoothllm_pert_type', 'RandomPatchPerturbation')
-        pert_pct = data.get('smoothllm_pert_pct', 10)
-        target_model_name = data.get('target_model', 'tinyllama')
-        
-        if not prompt:
-            return jsonify({'error': 'Prompt is required'}), 400
-        
-        # Use mock analysis for Netlify deployment
-        print("Using mock analysis for Netlify deployment...")
-        
-        # Simple heuristic to determine if prompt is potentially harmful
-        harmful_keywords = [
-            'kill', 'murder', 'harm', 'hurt', 'attack', 'destroy', 'poison', 
-            'bomb', 'hack', 'steal', 'fraud', 'illegal', 'violence', 'weapon',
-            'hate', 'discrimination', 'suicide', 'self-harm', 'dangerous',
-            'bomb', 'terrorist', 'threat', 'danger', 'weapon', 'gun'
-        ]
-        
-        prompt_lower = prompt.lower()
-        is_harmful = any(keyword in prompt_lower for keyword in harmful_keywords)
-        
-        # Mock jailbreak percentage (higher for harmful prompts)
-        jb_percentage = 75.0 if is_harmful else 15.0
-        is_safe = bool(jb_percentage < 50)
-        
-        result = {
-            'jb_percentage': float(jb_percentage),
-            'is_safe': is_safe,
-            'total_prompts': 1,
-            'jailbroken_count': int(1 if not is_safe else 0),
-            'mock_response': True,
-            # Generic message for deployment-agnostic use
-            'message': 'Analysis completed successfully.'
-        }
+        num_copies = int(num_copies)
+    except (TypeError, ValueError):
+        num_copies = 0
+    if not 1 <= num_copies <= MAX_NUM_COPIES:
+        return None, ({'error': f'smoothllm_num_copies must be an integer between 1 and {MAX_NUM_COPIES}'}, 400, {})
+    
+    # In cascade mode the keyword score decides how many copies to run
+    route = cascade_router.route(prompt, num_copies) if CASCADE_ENABLED else None
+    if route is not None:
+        num_copies = route.num_copies
+    return AnalyzeRequest(prompt, num_copies, pert_type, pert_pct, target_model_name, route), None
+
+def _handle_analyze(data, user_id, client_key, prepared=None):
+    try:
+        if prepared is None:
+            prepared, response = prepare_analysis(data)
+            if response is not None:
+                return response
+        num_copies = prepared.num_copies
+        
+        if num_copies == 0:
+            # Routed as benign with no vote: nothing to price or run
+            result = routed_benign_result()
+        else:
+            # Identical concurrent requests share one evaluation; only its leader is admitted,
+            # so followers are not charged to their own client's bucket (they cost no model time)
+            evaluate = functools.partial(
+                admitted_analysis, prepared.prompt, num_copies, prepared.pert_type, prepared.pert_pct,
+                prepared.target_model_name, client_key, prepared.ticket
+            )
+            try:
+                if analysis_flight is None:
+                    result = evaluate()
+                else:
+                    result, shared = analysis_flight.do(prepared.key(), evaluate)
+                    result = dict(result, coalesced=shared)
+            except (RequestTooExpensive, AdmissionRejected) as e:
+                return admission_error_response(e)
+        if prepared.route is not None:
+            result['route'] = prepared.route.to_dict()
         
         # Save to history if user is logged in
-        if 'user_id' in session:
+        if user_id is not None:
             save_prompt_history(
-                user_id=session['user_id'],
-                prompt=prompt,
-                is_safe=is_safe,
-                jailbreak_rate=jb_percentage,
+                user_id=user_id,
+                prompt=prepared.prompt,
+                is_safe=result['is_safe'],
+                jailbreak_rate=result['jb_percentage'],
                 perturbations=num_copies,
-                perturbation_type=pert_type,
-                perturbation_pct=pert_pct
+                perturbation_type=prepared.pert_type,
+                perturbation_pct=prepared.pert_pct
             )
         
-        return jsonify(result)
+        return result, 200, {}
         
     except Exception as e:
         print(f"Error in analyze_prompt: {e}")
-        return jsonify({'error': 'Analysis failed'}), 500
+        return {'error': 'Analysis failed'}, 500, {}
+    finally:
+        # Return a reservation that was not used, e.g. by a request that followed another
+        if prepared is not None and prepared.ticket is not None:
+            prepared.ticket.release()
+
+def admit_analysis(prompt, num_copies, client_key):
+    """Price the request and reserve its cost; raises RequestTooExpensive or AdmissionRejected."""
+    cost = admission.estimate_cost(num_copies, prompt)
+    ticket = admission.admit(client_key or 'anonymous', cost)
+    ADMISSION_DECISIONS.inc(decision='admitted')
+    return ticket
+
+def admission_error_response(error):
+    """(payload, status, headers) for a request that admission control turned away."""
+    if isinstance(error, RequestTooExpensive):
+        ADMISSION_DECISIONS.inc(decision='too_expensive')
+        return {'error': str(error)}, 400, {}
+    ADMISSION_DECISIONS.inc(decision='rejected')
+    retry_after = max(1, math.ceil(error.retry_after))
+    return (
+        {'error': error.reason, 'retry_after': retry_after},
+        429,
+        {'Retry-After': str(retry_after)}
+    )
+
+def admitted_analysis(prompt, num_copies, pert_type, pert_pct, target_model_name, client_key, ticket=None):
+    """Reserve the request's cost unless `ticket` already holds it, then run the analysis.
+
+    Admission errors propagate.
+    """
+    # Price the request and reserve capacity before any model work
+    if ticket is None:
+        ticket = admit_analysis(prompt, num_copies, client_key)
+    tracer = profiling.active_tracer()
+    with ticket, (tracer.span('run_analysis', cost=ticket.cost) if tracer is not None else profiling.NULL_SPAN):
+        return run_analysis(prompt, num_copies, pert_type, pert_pct, target_model_name)
+
+def run_analysis(prompt, num_copies, pert_type, pert_pct, target_model_name):
+    """Inference backend for /api/analyze; returns the result payload."""
+    if daemon_client is not None:
+        return daemon_analysis(prompt, num_copies, pert_type, pert_pct, target_model_name)
+    
+    # Use mock analysis for Netlify deployment
+    print("Using mock analysis for Netlify deployment...")
+    
+    # Simple heuristic to determine if prompt is potentially harmful
+    is_harmful = contains_keyword(prompt)
+    
+    # Mock jailbreak percentage (higher for harmful prompts)
+    jb_percentage = 75.0 if is_harmful else 15.0
+    is_safe = bool(jb_percentage < 50)
+    
+    return {
+        'jb_percentage': float(jb_percentage),
+        'is_safe': is_safe,
+        'total_prompts': 1,
+        'jailbroken_count': int(1 if not is_safe else 0),
+        'mock_response': True,
+        # Generic message for deployment-agnostic use
+        'message': 'Analysis completed successfully.'
+    }
+
+def daemon_analysis(prompt, num_copies, pert_type, pert_pct, target_model_name):
+    """Run SmoothLLM on the inference daemon and shape its result like the mock payload."""
+    result = daemon_client.analyze(
+        target_model_name,
+        prompt,
+        num_copies=num_copies,
+        pert_type=pert_type,
+        pert_pct=pert_pct
+    )
+    is_safe = not result['is_jailbroken']
+    return {
+        'jb_percentage': float(result['jb_percentage'] * 100),
+        'is_safe': is_safe,
+        'total_prompts': 1,
+        'jailbroken_count': int(not is_safe),
+        'copies_evaluated': result['num_evaluated'],
+        'response': result['output'],
+        'message': 'Analysis completed successfully.'
+    }
+
+def routed_benign_result():
+    """Payload for a prompt the cascade routed as benign with no copies."""
+    return {
+        'jb_percentage': 0.0,
+        'is_safe': True,
+        'total_prompts': 1,
+        'jailbroken_count': 0,
+        'message': 'Prompt routed as benign; SmoothLLM vote skipped.'
+    }
 
 @app.route('/api/signin', methods=['POST'])
 def api_signin():
@@ -191,7 +487,13 @@ def api_signin():
         ).fetchone()
         conn.close()
         
-        if user and verify_password(password, user['password_hash']):
+        # Verify against a dummy hash for unknown emails so timing does not reveal accounts
+        password_hash = user['password_hash'] if user else dummy_password_hash()
+        if verify_password(password, password_hash) and user:
+            # Transparently upgrade legacy or outdated hashes
+            if needs_rehash(user['password_hash']):
+                upgrade_password_hash(user['id'], password)
+
             session['user_id'] = user['id']
             session['user_name'] = user['name']
             session['user_email'] = user['email']
@@ -211,6 +513,20 @@ def api_signin():
         print(f"Error in api_signin: {e}")
         return jsonify({'error': 'Sign in failed'}), 500
 
+def upgrade_password_hash(user_id, password):
+    """Re-hash a verified password with the current scheme and cost parameters."""
+    try:
+        conn = get_db_connection()
+        conn.execute(
+            'UPDATE users SET password_hash = ? WHERE id = ?',
+            (hash_password(password), user_id)
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        # The old hash still works, so a failed upgrade must not fail the sign in
+        print(f"Error upgrading password hash: {e}")
+
 @app.route('/api/signup', methods=['POST'])
 def api_signup():
     """Handle user sign up."""
@@ -277,6 +593,9 @@ def get_history():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
+    # Read-your-writes: wait for this worker's queued history rows
+    history_writer.flush()
+
     try:
         conn = get_db_connection()
         history = conn.execute(
@@ -288,18 +607,7 @@ def get_history():
         ).fetchall()
         conn.close()
         
-        history_list = []
-        for item in history:
-            history_list.append({
-                'id': item['id'],
-                'prompt': item['prompt'],
-                'is_safe': bool(item['is_safe']),
-                'jailbreak_rate': item['jailbreak_rate'],
-                'perturbations': item['perturbations'],
-                'perturbation_type': item['perturbation_type'],
-                'perturbation_pct': item['perturbation_pct'],
-                'created_at': item['created_at']
-            })
+        history_list = [history_row_to_dict(item) for item in history]
         
         return jsonify({'history': history_list})
         
@@ -308,19 +616,10 @@ def get_history():
         return jsonify({'error': 'Failed to fetch history'}), 500
 
 def save_prompt_history(user_id, prompt, is_safe, jailbreak_rate, perturbations, perturbation_type, perturbation_pct):
-    """Save prompt analysis to history."""
-    try:
-        conn = get_db_connection()
-        conn.execute(
-            '''INSERT INTO prompt_history 
-               (user_id, prompt, is_safe, jailbreak_rate, perturbations, perturbation_type, perturbation_pct)
-               VALUES (?, ?, ?, ?, ?, ?, ?)''',
-            (user_id, prompt, is_safe, jailbreak_rate, perturbations, perturbation_type, perturbation_pct)
-        )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"Error saving prompt history: {e}")
+    """Queue prompt analysis for the background history writer."""
+    history_writer.submit(
+        (user_id, prompt, is_safe, jailbreak_rate, perturbations, perturbation_type, perturbation_pct)
+    )
 
 @app.route('/api/user', methods=['GET'])
 def get_user():
@@ -342,6 +641,9 @@ def get_user_stats():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
+    # Read-your-writes: wait for this worker's queued history rows
+    history_writer.flush()
+
     try:
         conn = get_db_connection()
         
@@ -380,59 +682,151 @@ def get_user_stats():
 
 @app.route('/api/user/export', methods=['GET'])
 def export_user_data():
-    """Export user data as JSON."""
+    """Stream user data as JSON, NDJSON or CSV, optionally gzip-compressed.
+
+    Query parameters:
+        format: 'json' (default), 'ndjson' or 'csv'
+        gzip: '1' to gzip-compress the response body
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
-    
+
+    export_format = request.args.get('format', 'json').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    # Read-your-writes: wait for this worker's queued history rows
+    history_writer.flush()
+
     try:
         conn = get_db_connection()
-        
+
         # Get user info
         user = conn.execute(
             'SELECT * FROM users WHERE id = ?', (session['user_id'],)
         ).fetchone()
-        
-        # Get user history
-        history = conn.execute(
+
+        if not user:
+            conn.close()
+            return jsonify({'error': 'User not found'}), 404
+
+        # Get user history; rows are pulled from the cursor in chunks while streaming
+        cursor = conn.execute(
             '''SELECT * FROM prompt_history 
                WHERE user_id = ? 
                ORDER BY created_at DESC''',
             (session['user_id'],)
-        ).fetchall()
-        
-        conn.close()
-        
-        # Prepare export data
-        export_data = {
-            'user': {
-                'id': user['id'],
-                'name': user['name'],
-                'email': user['email'],
-                'created_at': user['created_at']
-            },
-            'history': [
-                {
-                    'id': item['id'],
-                    'prompt': item['prompt'],
-                    'is_safe': bool(item['is_safe']),
-                    'jailbreak_rate': item['jailbreak_rate'],
-                    'perturbations': item['perturbations'],
-                    'perturbation_type': item['perturbation_type'],
-                    'perturbation_pct': item['perturbation_pct'],
-                    'created_at': item['created_at']
-                }
-                for item in history
-            ],
-            'export_date': datetime.now().isoformat(),
-            'total_records': len(history)
-        }
-        
-        return jsonify(export_data)
-        
+        )
     except Exception as e:
         print(f"Error in export_user_data: {e}")
         return jsonify({'error': 'Failed to export data'}), 500
 
+    user_data = {
+        'id': user['id'],
+        'name': user['name'],
+        'email': user['email'],
+        'created_at': user['created_at']
+    }
+    chunks = EXPORT_FORMATS[export_format]['writer'](user_data, iter_history_rows(conn, cursor))
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+
+    filename = f"smoothllm-export.{EXPORT_FORMATS[export_format]['extension']}"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(
+        chunks,
+        mimetype=EXPORT_FORMATS[export_format]['mimetype'],
+        headers=headers
+    )
+
+def history_row_to_dict(item):
+    """Convert a prompt_history row to its JSON representation."""
+    return {
+        'id': item['id'],
+        'prompt': item['prompt'],
+        'is_safe': bool(item['is_safe']),
+        'jailbreak_rate': item['jailbreak_rate'],
+        'perturbations': item['perturbations'],
+        'perturbation_type': item['perturbation_type'],
+        'perturbation_pct': item['perturbation_pct'],
+        'created_at': item['created_at']
+    }
+
+def iter_history_rows(conn, cursor):
+    """Yield history rows as dicts, fetching EXPORT_CHUNK_SIZE rows at a time.
+
+    The connection is closed once the cursor is exhausted or the client goes away.
+    """
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            for item in rows:
+                yield history_row_to_dict(item)
+    finally:
+        conn.close()
+
+def write_export_json(user_data, history_rows):
+    """Yield a single JSON document, one history item at a time."""
+    yield '{"user": ' + json.dumps(user_data) + ', "history": ['
+    total_records = 0
+    for item in history_rows:
+        yield (', ' if total_records else '') + json.dumps(item)
+        total_records += 1
+    yield '], "export_date": ' + json.dumps(datetime.now().isoformat())
+    yield ', "total_records": ' + str(total_records) + '}'
+
+def write_export_ndjson(user_data, history_rows):
+    """Yield one JSON object per line: the user, each history item, then a footer."""
+    yield json.dumps({'type': 'user', 'user': user_data}) + '\n'
+    total_records = 0
+    for item in history_rows:
+        yield json.dumps({'type': 'history', 'item': item}) + '\n'
+        total_records += 1
+    yield json.dumps({
+        'type': 'summary',
+        'export_date': datetime.now().isoformat(),
+        'total_records': total_records
+    }) + '\n'
+
+def write_export_csv(user_data, history_rows):
+    """Yield the history as CSV rows (user info is implied by the session)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HISTORY_EXPORT_FIELDS)
+    for item in history_rows:
+        writer.writerow([item[field] for field in HISTORY_EXPORT_FIELDS])
+        if buffer.tell() >= EXPORT_FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks incrementally."""
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+HISTORY_EXPORT_FIELDS = [
+    'id', 'prompt', 'is_safe', 'jailbreak_rate', 'perturbations',
+    'perturbation_type', 'perturbation_pct', 'created_at'
+]
+
+EXPORT_FORMATS = {
+    'json': {'writer': write_export_json, 'mimetype': 'application/json', 'extension': 'json'},
+    'ndjson': {'writer': write_export_ndjson, 'mimetype': 'application/x-ndjson', 'extension': 'ndjson'},
+    'csv': {'writer': write_export_csv, 'mimetype': 'text/csv', 'extension': 'csv'},
+}
+
 @app.route('/api/user/change-password', methods=['POST'])
 def change_password():
     """Change user password."""
@@ -494,6 +888,9 @@ def delete_account():
         if not password:
             return jsonify({'error': 'Password is required to delete account'}), 400
         
+        # Make sure queued history rows are written before they are deleted
+        history_writer.flush()
+
         conn = get_db_connection()
         
         # Get current user
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+ASGI entry point for async serving.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+POST /api/analyze is served natively: each request is a coroutine that awaits
+the inference backend running in a bounded executor, so a process can hold
+hundreds of open analyze requests while only ASGI_INFERENCE_WORKERS run at
+once. Requests are validated and admitted on the event loop before they are
+queued, so admission control answers 429 immediately and its in-flight
+budget (ADMISSION_MAX_INFLIGHT) bounds how much work waits for a worker. Every other route is the unchanged Flask app, run on a separate thread
+pool so sign in, history and export requests (and their SQLite queries) keep
+being served while analyze calls are in flight.
+"""
+
+import asyncio
+import collections
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import session
+
+from app import (
+    app, handle_analyze, prepare_analysis, admit_analysis, admission_error_response, analysis_flight,
+    history_writer, admission_key, trace_requested, AdmissionRejected, RequestTooExpensive,
+    HTTP_REQUEST_SECONDS
+)
+
+INFERENCE_WORKERS = int(os.environ.get('ASGI_INFERENCE_WORKERS', 4))
+WSGI_WORKERS = int(os.environ.get('ASGI_WSGI_WORKERS', 16))
+MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', 1024 * 1024))
+
+_inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix='asgi-inference')
+_wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_WORKERS, thread_name_prefix='asgi-wsgi')
+
+# Analyze requests queued for or running on the inference executor, by
+# coalescing key; only touched from the event loop
+_queued_keys = collections.Counter()
+
+class RequestTooLarge(Exception):
+    pass
+
+async def application(scope, receive, send):
+    """ASGI application."""
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if scope['path'] == '/api/analyze' and scope['method'] == 'POST':
+            await handle_analyze_async(scope, receive, send)
+        else:
+            await handle_wsgi(scope, receive, send)
+    else:
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Flush queued prompt history before the process exits
+            await asyncio.get_running_loop().run_in_executor(None, history_writer.close)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def handle_analyze_async(scope, receive, send):
+    """Native async /api/analyze."""
+    start = time.perf_counter()
+    try:
+        body = await read_body(receive)
+    except RequestTooLarge:
+        await send_json(send, 413, {'error': 'Request body too large'})
+        return
+
+    environ = build_environ(scope, body)
+
+    # Decode the signed session cookie exactly as Flask would
+    with app.request_context(environ) as context:
+        user_id = session.get('user_id')
+        trace = trace_requested(context.request.headers)
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    client_key = admission_key(user_id, environ.get('REMOTE_ADDR'))
+    try:
+        prepared, response = admit_on_loop(data, client_key)
+    except Exception as e:
+        print(f"Error in analyze_prompt: {e}")
+        prepared, response = None, ({'error': 'Analysis failed'}, 500, {})
+    if response is not None:
+        payload, status, headers = response
+    else:
+        key = prepared.key()
+        _queued_keys[key] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            payload, status, headers = await loop.run_in_executor(
+                _inference_executor, handle_analyze, data, user_id, client_key, trace, prepared
+            )
+        finally:
+            _queued_keys[key] -= 1
+            if not _queued_keys[key]:
+                del _queued_keys[key]
+    await send_json(send, status, payload, headers)
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        route='/api/analyze',
+        method='POST',
+        status=status
+    )
+
+def admit_on_loop(data, client_key):
+    """Validate, route and admit an analyze request before it is queued.
+
+    These steps are cheap, so they run on the event loop: a request over its
+    budget gets its 429 without waiting for an inference worker. A request
+    identical to one already queued or running is not charged here; it will
+    share that evaluation (or be admitted by SingleFlight if it ends up leading).
+    """
+    prepared, response = prepare_analysis(data)
+    if response is not None or not prepared.num_copies:
+        return prepared, response
+    key = prepared.key()
+    if analysis_flight is not None and (_queued_keys[key] or analysis_flight.pending(key)):
+        return prepared, None
+    try:
+        prepared.ticket = admit_analysis(prepared.prompt, prepared.num_copies, client_key)
+    except (RequestTooExpensive, AdmissionRejected) as e:
+        return None, admission_error_response(e)
+    return prepared, None
+
+async def handle_wsgi(scope, receive, send):
+    """Run the Flask app for one request on the WSGI thread pool."""
+    try:
+        body = await read_body(receive)
+    except RequestTooLarge:
+        await send_json(send, 413, {'error': 'Request body too large'})
+        return
+
+    environ = build_environ(scope, body)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_wsgi_executor, run_wsgi, environ, loop, send)
+
+def run_wsgi(environ, loop, send):
+    """Call the WSGI app and forward its (possibly streamed) body to ASGI."""
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+
+    def send_sync(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    result = app(environ, start_response)
+    try:
+        started = False
+        for chunk in result:
+            if not chunk:
+                continue
+            if not started:
+                send_sync({'type': 'http.response.start', **response_start})
+                started = True
+            send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not started:
+            send_sync({'type': 'http.response.start', **response_start})
+        send_sync({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise RequestTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+async def send_json(send, status, payload, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    raw_headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('latin-1')),
+    ]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode('latin-1'), str(value).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into a WSGI environ (PEP 3333)."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # The body is fully buffered and de-chunked, so its length is known even for
+    # chunked uploads (WSGI apps ignore Content-Length when chunking is declared)
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ.pop('HTTP_TRANSFER_ENCODING', None)
+    return environ
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,213 @@
+"""
+Assisted decoding benchmark: generation tokens/sec and SmoothLLM verdict
+agreement with and without a draft model or prompt lookup.
+
+Every mode generates for the bundled GCG behaviors. Tokens/sec is measured
+over one generation per behavior. For verdict agreement every mode decodes
+greedily on the same seeded perturbed copies, so differences come from the
+decoding mode alone; it is the fraction of behaviors (and of copies) whose
+SmoothLLM verdict matches that of default decoding. By
+default a tiny local target and an even smaller draft model sharing its
+tokenizer are used, so nothing is downloaded; pass --target_model and
+--draft_model to benchmark a real pair from lib/model_configs.py.
+
+    python -m benchmarks.bench_assisted
+    python -m benchmarks.bench_assisted --target_model vicuna --draft_model tinyllama
+"""
+
+import argparse
+import time
+
+import torch
+
+import lib.attacks as attacks
+import lib.defenses as defenses
+import lib.language_models as language_models
+import lib.model_configs as model_configs
+import lib.perturbations as perturbations
+from benchmarks.common import save_results
+from benchmarks.tiny_model import build_tiny_llm
+
+def load_model(name, device):
+    config = model_configs.MODELS[name]
+    return language_models.LLM(
+        model_path=config['model_path'],
+        tokenizer_path=config['tokenizer_path'],
+        conv_template_name=config['conversation_template'],
+        device=device,
+        do_sample=False
+    )
+
+def load_models(args):
+    if args.target_model:
+        device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+        target_model = load_model(args.target_model, device)
+        draft_model = load_model(args.draft_model, device) if args.draft_model else None
+        return target_model, draft_model
+    target_model = build_tiny_llm(hidden_size=args.hidden_size, num_layers=args.num_layers)
+    target_model.do_sample = False
+    draft_model = build_tiny_llm(hidden_size=args.draft_hidden_size, num_layers=1, seed=1)
+    return target_model, draft_model
+
+def bench_generation(target_model, prompts, max_new_tokens):
+    start = time.perf_counter()
+    outputs = [target_model([prompt.full_prompt], max_new_tokens=max_new_tokens)[0] for prompt in prompts]
+    elapsed = time.perf_counter() - start
+    generated = sum(
+        len(target_model.tokenizer(output, add_special_tokens=False).input_ids)
+        for output in outputs
+    )
+    return {'generated_tokens': generated, 'seconds': elapsed, 'tokens_per_s': generated / elapsed}
+
+def perturbed_copies(target_model, prompts, args):
+    """One set of seeded perturbed copies per prompt, shared by every mode."""
+    perturbation_fn = perturbations.get_perturbation(
+        args.pert_type,
+        q=args.pert_pct,
+        tokenizer=target_model.tokenizer,
+        seed=args.seed
+    )
+    return [prompt.perturbed_batch(perturbation_fn, args.num_copies) for prompt in prompts]
+
+def smoothllm_verdicts(target_model, prompts, copies):
+    """Per-copy verdicts and majority votes for the shared copies."""
+    judge = defenses.Defense(target_model)
+    copy_verdicts, verdicts = [], []
+    for prompt, batch in zip(prompts, copies):
+        judge.set_original_prompt(prompt.perturbable_prompt)
+        outputs = target_model(batch, max_new_tokens=prompt.max_new_tokens)
+        batch_verdicts = [judge.is_jailbroken(output) for output in outputs]
+        result = defenses.SmoothLLMResult(len(batch))
+        result.add_batch(batch, outputs, batch_verdicts)
+        copy_verdicts.append(batch_verdicts)
+        verdicts.append(result.is_jailbroken)
+    return copy_verdicts, verdicts
+
+def main(args):
+    torch.manual_seed(args.seed)
+    target_model, draft_model = load_models(args)
+    attack = attacks.GCG(logfile=args.attack_logfile, target_model=target_model)
+    prompts = attack.prompts[:args.num_prompts]
+    for prompt in prompts:
+        prompt.max_new_tokens = args.max_new_tokens
+    copies = perturbed_copies(target_model, prompts, args)
+
+    modes = {
+        'default': {},
+        'prompt_lookup': {'prompt_lookup_num_tokens': args.prompt_lookup_num_tokens},
+    }
+    if draft_model is not None:
+        modes['assistant_model'] = {'assistant_model': draft_model}
+
+    results = {}
+    for mode, kwargs in modes.items():
+        target_model.enable_assisted_decoding(**kwargs)
+        torch.manual_seed(args.seed)
+        results[mode] = bench_generation(target_model, prompts, args.max_new_tokens)
+        results[mode]['copy_verdicts'], results[mode]['verdicts'] = smoothllm_verdicts(
+            target_model, prompts, copies
+        )
+
+    baseline = results['default']
+    for mode, result in results.items():
+        result['speedup'] = result['tokens_per_s'] / baseline['tokens_per_s']
+        result['verdict_agreement'] = sum(
+            a == b for a, b in zip(result['verdicts'], baseline['verdicts'])
+        ) / len(prompts)
+        pairs = [
+            (a, b)
+            for copies_a, copies_b in zip(result['copy_verdicts'], baseline['copy_verdicts'])
+            for a, b in zip(copies_a, copies_b)
+        ]
+        result['copy_verdict_agreement'] = sum(a == b for a, b in pairs) / len(pairs)
+        print(
+            f"{mode}: {result['tokens_per_s']:.1f} tokens/s ({result['speedup']:.2f}x), "
+            f"verdict agreement {result['verdict_agreement']:.0%} "
+            f"(copies {result['copy_verdict_agreement']:.0%})"
+        )
+    target_model.enable_assisted_decoding()
+
+    save_results('assisted', {'config': vars(args), 'modes': results}, args.output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--attack_logfile',
+        type=str,
+        default='data/GCG/vicuna_behaviors.json'
+    )
+    parser.add_argument(
+        '--num_prompts',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--max_new_tokens',
+        type=int,
+        default=64
+    )
+    parser.add_argument(
+        '--prompt_lookup_num_tokens',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--pert_type',
+        type=str,
+        default='RandomSwapPerturbation'
+    )
+    parser.add_argument(
+        '--pert_pct',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--num_copies',
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0
+    )
+
+    # Real model pair from lib/model_configs.py
+    parser.add_argument(
+        '--target_model',
+        type=str,
+        default=None,
+        choices=list(model_configs.MODELS)
+    )
+    parser.add_argument(
+        '--draft_model',
+        type=str,
+        default=None,
+        choices=list(model_configs.MODELS)
+    )
+
+    # Tiny model sizes, used when --target_model is not given
+    parser.add_argument(
+        '--hidden_size',
+        type=int,
+        default=256
+    )
+    parser.add_argument(
+        '--num_layers',
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        '--draft_hidden_size',
+        type=int,
+        default=64
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Results JSON path (default benchmarks/results/assisted-<commit>.json)'
+    )
+
+    args = parser.parse_args()
+    main(args)
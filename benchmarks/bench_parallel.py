@@ -0,0 +1,166 @@
+"""
+Scaling benchmark for data-parallel SmoothLLM evaluation on a tiny local model.
+
+Evaluates the same prompts with 1, 2, 4, ... worker processes up to every
+available core and reports throughput, speedup and parallel efficiency
+relative to one worker. Model loading is excluded from the timings.
+
+    python -m benchmarks.bench_parallel
+    python -m benchmarks.bench_parallel --workers 1 2 4 8 --num_prompts 32 --split_copies
+"""
+
+import argparse
+import functools
+import time
+
+import lib.attacks as attacks
+import lib.parallel as parallel
+from benchmarks.common import save_results
+from benchmarks.tiny_model import build_tiny_llm
+
+def worker_counts(max_workers):
+    counts, n = [], 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+def bench_workers(model_factory, prompts, args, num_workers):
+    evaluator = parallel.ParallelSmoothLLM(
+        model_factory=model_factory,
+        pert_type=args.pert_type,
+        pert_pct=args.pert_pct,
+        num_copies=args.num_copies,
+        num_workers=num_workers,
+        threads_per_worker=args.threads_per_worker,
+        batch_size=args.batch_size
+    )
+    with evaluator:
+        # Warm up every replica before timing
+        evaluator.evaluate(prompts[:num_workers], split_copies=args.split_copies)
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            evaluator.evaluate(prompts, split_copies=args.split_copies)
+            times.append(time.perf_counter() - start)
+    elapsed = min(times)
+    return {
+        'num_workers': num_workers,
+        'cores_per_worker': [len(group) for group in evaluator.groups],
+        'min_s': elapsed,
+        'prompts_per_s': len(prompts) / elapsed,
+        'copies_per_s': len(prompts) * args.num_copies / elapsed,
+    }
+
+def main(args):
+    model_factory = functools.partial(
+        build_tiny_llm,
+        hidden_size=args.hidden_size,
+        num_layers=args.num_layers
+    )
+    attack = attacks.GCG(logfile=args.attack_logfile, target_model=model_factory())
+    prompts = [attack.prompts[i % len(attack.prompts)] for i in range(args.num_prompts)]
+    for prompt in prompts:
+        prompt.max_new_tokens = args.max_new_tokens
+
+    max_workers = args.max_workers or len(parallel.available_cpus())
+    results = []
+    for num_workers in args.workers or worker_counts(max_workers):
+        result = bench_workers(model_factory, prompts, args, num_workers)
+        result['speedup'] = results[0]['min_s'] / result['min_s'] if results else 1.0
+        result['efficiency'] = result['speedup'] * results[0]['num_workers'] / num_workers if results else 1.0
+        results.append(result)
+        print(
+            f"{num_workers} workers: {result['prompts_per_s']:.2f} prompts/s, "
+            f"speedup {result['speedup']:.2f}x, efficiency {result['efficiency']:.0%}"
+        )
+
+    save_results('parallel', {'config': vars(args), 'scaling': results}, args.output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--attack_logfile',
+        type=str,
+        default='data/GCG/vicuna_behaviors.json'
+    )
+    parser.add_argument(
+        '--pert_type',
+        type=str,
+        default='RandomSwapPerturbation'
+    )
+    parser.add_argument(
+        '--pert_pct',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--num_prompts',
+        type=int,
+        default=16
+    )
+    parser.add_argument(
+        '--num_copies',
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        '--max_new_tokens',
+        type=int,
+        default=32
+    )
+    parser.add_argument(
+        '--split_copies',
+        action='store_true',
+        help='Distribute batches of copies instead of whole prompts'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        nargs='+',
+        default=None,
+        help='Worker counts to run (default: powers of two up to --max_workers)'
+    )
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=None,
+        help='Largest worker count (default: every available core)'
+    )
+    parser.add_argument(
+        '--threads_per_worker',
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=3
+    )
+
+    # Tiny model size
+    parser.add_argument(
+        '--hidden_size',
+        type=int,
+        default=64
+    )
+    parser.add_argument(
+        '--num_layers',
+        type=int,
+        default=2
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Results JSON path (default benchmarks/results/parallel-<commit>.json)'
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,82 @@
+"""
+Login throughput benchmark for the password hashing settings in passwords.py.
+
+Measures single-hash latency and sustained verifications per second when many
+concurrent sign-ins share the bounded hashing pool.
+
+    python -m benchmarks.bench_passwords --concurrency 32 --logins 200
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import passwords
+
+def main(args):
+    password_hash = passwords.hash_password('correct horse battery staple')
+
+    # Latency of one verification with an idle pool
+    latencies = []
+    for _ in range(args.samples):
+        start = time.perf_counter()
+        assert passwords.verify_password('correct horse battery staple', password_hash)
+        latencies.append(time.perf_counter() - start)
+
+    # Throughput under a login storm: more request threads than hash workers
+    with ThreadPoolExecutor(max_workers=args.concurrency) as request_threads:
+        start = time.perf_counter()
+        results = list(request_threads.map(
+            lambda _: passwords.verify_password('correct horse battery staple', password_hash),
+            range(args.logins)
+        ))
+        elapsed = time.perf_counter() - start
+    assert all(results)
+
+    summary = {
+        'scheme': passwords.DEFAULT_SCHEME,
+        'scrypt_n': passwords.SCRYPT_N,
+        'scrypt_r': passwords.SCRYPT_R,
+        'scrypt_p': passwords.SCRYPT_P,
+        'pbkdf2_iterations': passwords.PBKDF2_ITERATIONS,
+        'hash_workers': passwords.HASH_WORKERS,
+        'request_concurrency': args.concurrency,
+        'verify_latency_ms_median': statistics.median(latencies) * 1000,
+        'verify_latency_ms_max': max(latencies) * 1000,
+        'logins_per_second': args.logins / elapsed,
+    }
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=20
+    )
+    parser.add_argument(
+        '--logins',
+        type=int,
+        default=200
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=32
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,210 @@
+"""
+Offline benchmark of the SmoothLLM pipeline on a tiny local model.
+
+Measures perturbation throughput, tokenization, generation tokens/sec,
+end-to-end SmoothLLM.__call__ latency over a grid of num_copies and batch
+sizes, judge throughput, and sampling one prompt many times with and
+without a shared prefill. Nothing is downloaded: the model and tokenizer
+are built by benchmarks/tiny_model.py.
+
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --num_copies 4 16 --batch_sizes 8 --output before.json
+"""
+
+import argparse
+import copy
+import time
+
+import torch
+
+import lib.attacks as attacks
+import lib.defenses as defenses
+import lib.perturbations as perturbations
+from benchmarks.common import save_results, time_call
+from benchmarks.tiny_model import build_tiny_llm
+
+PERTURBATION_TYPES = list(perturbations.available_perturbations())
+
+def bench_perturbations(prompt, pert_pct, calls, tokenizer):
+    results = {}
+    for pert_type in PERTURBATION_TYPES:
+        perturbation_fn = perturbations.get_perturbation(pert_type, q=pert_pct, tokenizer=tokenizer)
+        text = prompt.perturbable_prompt
+        timing = time_call(lambda: [perturbation_fn(text) for _ in range(calls)])
+        batched = time_call(lambda: perturbation_fn.perturb_batch(text, calls))
+        results[pert_type] = {
+            'calls_per_s': calls / timing['median_s'],
+            'chars_per_s': calls * len(text) / timing['median_s'],
+            'batched_copies_per_s': calls / batched['median_s'],
+        }
+    return results
+
+def bench_tokenization(target_model, inputs):
+    timing = time_call(lambda: target_model.tokenizer(inputs, padding=True, return_tensors='pt'))
+    return {
+        'batch_size': len(inputs),
+        'inputs_per_s': len(inputs) / timing['median_s'],
+        **timing
+    }
+
+def bench_generation(target_model, inputs, batch_sizes, max_new_tokens):
+    results = {}
+    for batch_size in batch_sizes:
+        batch = inputs[:batch_size]
+        generated = []
+
+        def run():
+            outputs = target_model(batch=batch, max_new_tokens=max_new_tokens)
+            generated.append(sum(len(target_model.tokenizer(o).input_ids) for o in outputs))
+
+        timing = time_call(run, repeats=3)
+        results[str(batch_size)] = {
+            'tokens_per_s': (sum(generated) / len(generated)) / timing['median_s'],
+            **timing
+        }
+    return results
+
+def bench_smoothllm(target_model, prompt, pert_type, pert_pct, num_copies_grid, batch_sizes):
+    results = []
+    for num_copies in num_copies_grid:
+        defense = defenses.SmoothLLM(
+            target_model=target_model,
+            pert_type=pert_type,
+            pert_pct=pert_pct,
+            num_copies=num_copies
+        )
+        defense.set_original_prompt(prompt.perturbable_prompt)
+        for batch_size in batch_sizes:
+            timing = time_call(lambda: defense(prompt, batch_size=batch_size), repeats=3)
+            results.append({
+                'num_copies': num_copies,
+                'batch_size': batch_size,
+                **timing
+            })
+            print(f"SmoothLLM num_copies={num_copies} batch_size={batch_size}: {timing['median_s']:.3f}s")
+    return results
+
+def bench_shared_prefill(target_model, prompt, samples, max_new_tokens):
+    """Sampling one prompt k times: replicated inputs versus one shared prefill."""
+    replicated = time_call(
+        lambda: target_model(batch=[prompt.full_prompt] * samples, max_new_tokens=max_new_tokens),
+        repeats=3
+    )
+    shared = time_call(
+        lambda: target_model.generate_samples([(prompt.full_prompt, samples)], max_new_tokens=max_new_tokens),
+        repeats=3
+    )
+    print(f"{samples} samples: replicated {replicated['median_s']:.3f}s, shared prefill {shared['median_s']:.3f}s")
+    return {'samples': samples, 'replicated': replicated, 'shared_prefill': shared}
+
+def bench_judge(target_model, prompt, outputs, calls):
+    defense = defenses.Defense(target_model)
+    defense.set_original_prompt(prompt.perturbable_prompt)
+    timing = time_call(lambda: [defense.is_jailbroken(outputs[i % len(outputs)]) for i in range(calls)])
+    return {'judgements_per_s': calls / timing['median_s'], **timing}
+
+def main(args):
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+
+    target_model = build_tiny_llm(
+        hidden_size=args.hidden_size,
+        num_layers=args.num_layers
+    )
+    attack = attacks.GCG(logfile=args.attack_logfile, target_model=target_model)
+    prompt = copy.copy(attack.prompts[0])
+    prompt.max_new_tokens = args.max_new_tokens
+
+    perturbation_fn = perturbations.get_perturbation(
+        args.pert_type, q=args.pert_pct, tokenizer=target_model.tokenizer
+    )
+    inputs = prompt.perturbed_batch(perturbation_fn, max(args.batch_sizes))
+
+    results = {
+        'config': vars(args),
+        'prompt_chars': len(prompt.full_prompt),
+        'perturbation': bench_perturbations(prompt, args.pert_pct, args.perturbation_calls, target_model.tokenizer),
+        'tokenization': bench_tokenization(target_model, inputs),
+        'generation': bench_generation(target_model, inputs, args.batch_sizes, args.max_new_tokens),
+    }
+    outputs = target_model(batch=inputs[:8], max_new_tokens=args.max_new_tokens)
+    results['judge'] = bench_judge(target_model, prompt, outputs, args.judge_calls)
+    results['shared_prefill'] = bench_shared_prefill(
+        target_model, prompt, max(args.batch_sizes), args.max_new_tokens
+    )
+    results['smoothllm'] = bench_smoothllm(
+        target_model, prompt, args.pert_type, args.pert_pct, args.num_copies, args.batch_sizes
+    )
+
+    save_results('pipeline', results, args.output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--attack_logfile',
+        type=str,
+        default='data/GCG/vicuna_behaviors.json'
+    )
+    parser.add_argument(
+        '--pert_type',
+        type=str,
+        default='RandomSwapPerturbation',
+        choices=PERTURBATION_TYPES
+    )
+    parser.add_argument(
+        '--pert_pct',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--num_copies',
+        type=int,
+        nargs='+',
+        default=[2, 8, 16]
+    )
+    parser.add_argument(
+        '--batch_sizes',
+        type=int,
+        nargs='+',
+        default=[4, 16]
+    )
+    parser.add_argument(
+        '--max_new_tokens',
+        type=int,
+        default=32
+    )
+    parser.add_argument(
+        '--perturbation_calls',
+        type=int,
+        default=1000
+    )
+    parser.add_argument(
+        '--judge_calls',
+        type=int,
+        default=10000
+    )
+
+    # Tiny model size
+    parser.add_argument(
+        '--hidden_size',
+        type=int,
+        default=64
+    )
+    parser.add_argument(
+        '--num_layers',
+        type=int,
+        default=2
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Results JSON path (default benchmarks/results/pipeline-<commit>.json)'
+    )
+
+    args = parser.parse_args()
+    main(args)
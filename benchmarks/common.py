@@ -0,0 +1,84 @@
+"""
+Shared helpers for benchmark scripts: timing, environment capture and
+writing results as JSON for comparison across commits.
+"""
+
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+def time_call(fn, repeats=5, warmup=1):
+    """Run fn() repeatedly and summarize wall times in seconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        'repeats': repeats,
+        'median_s': statistics.median(times),
+        'mean_s': statistics.mean(times),
+        'min_s': min(times),
+        'max_s': max(times),
+    }
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (pct in [0, 100])."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+def git_commit():
+    """Short hash of the checked-out commit, or 'unknown' outside a git tree."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def environment():
+    """Machine and library details recorded alongside results."""
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+        info['cuda'] = torch.cuda.is_available()
+    except ImportError:
+        pass
+    return info
+
+def save_results(name, results, output=None):
+    """Write results to `output` (default benchmarks/results/<name>-<commit>.json)."""
+    commit = git_commit()
+    document = {
+        'benchmark': name,
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(),
+        'environment': environment(),
+        'results': results,
+    }
+    path = output or os.path.join(RESULTS_DIR, f'{name}-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}")
+    return path
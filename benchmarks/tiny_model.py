@@ -0,0 +1,49 @@
+"""
+Tiny randomly initialized causal LM and character-level tokenizer, built
+locally so that benchmarks run offline without downloading any weights.
+"""
+
+import string
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from lib.language_models import LLM
+
+def build_tiny_tokenizer():
+    """Character-level tokenizer over string.printable plus special tokens."""
+    vocab = {'<unk>': 0, '<s>': 1, '</s>': 2}
+    for ch in string.printable:
+        vocab.setdefault(ch, len(vocab))
+
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token='<unk>'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split('', 'isolated')
+    tokenizer.decoder = decoders.Fuse()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        unk_token='<unk>',
+        bos_token='<s>',
+        eos_token='</s>',
+        pad_token='<unk>'
+    )
+
+def build_tiny_model(vocab_size, hidden_size=64, num_layers=2, num_heads=4, seed=0):
+    """Randomly initialized Llama-architecture model."""
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=num_heads,
+        num_key_value_heads=num_heads,
+        max_position_embeddings=4096
+    )
+    return LlamaForCausalLM(config)
+
+def build_tiny_llm(hidden_size=64, num_layers=2, num_heads=4, seed=0, conv_template_name='llama-2'):
+    """LLM wrapper around the tiny model and tokenizer."""
+    tokenizer = build_tiny_tokenizer()
+    model = build_tiny_model(len(tokenizer), hidden_size, num_layers, num_heads, seed)
+    return LLM.from_model(model, tokenizer, conv_template_name)
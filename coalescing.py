@@ -0,0 +1,225 @@
+"""
+Single-flight coalescing of identical in-flight analyze requests.
+
+When the same prompt is analyzed with the same settings while an identical
+evaluation is already running, the new request waits for that evaluation
+and receives its result instead of starting another one:
+
+    flight = SingleFlight()          # or SingleFlight(DATABASE) across processes
+    result, shared = flight.do(request_key(prompt, num_copies, ...), evaluate)
+
+Within a process, callers wait on the leader's thread. When given a
+database, SingleFlight also coalesces across processes (gunicorn workers):
+the leader claims the key in the `inflight_analyses` table of the shared
+SQLite database, and leaders in other processes poll that row until the
+result is published. A claim is a lease: if its owner dies without
+publishing, the claim expires after `lease_seconds` and a waiting process
+takes over.
+
+Failures are not shared. If the leader raises (including an admission
+rejection), its own caller sees the exception and the waiting callers
+retry, one of them becoming the new leader. If only publishing the result
+fails, the leader still returns it and releases its claim, and remote
+waiters retry the same way.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import lib.metrics as metrics
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS inflight_analyses (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    finished_at REAL,
+    result TEXT
+)'''
+
+# Take the key if it is free, finished, or its lease has expired
+CLAIM_SQL = '''INSERT INTO inflight_analyses (key, owner, started_at, expires_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET
+        owner = excluded.owner,
+        started_at = excluded.started_at,
+        expires_at = excluded.expires_at,
+        finished_at = NULL,
+        result = NULL
+    WHERE inflight_analyses.finished_at IS NOT NULL
+       OR inflight_analyses.expires_at < excluded.started_at'''
+
+SINGLEFLIGHT_CALLS = metrics.counter(
+    'singleflight_calls',
+    'Analyze evaluations run as leader or shared with waiting requests',
+    ['role']
+)
+
+def request_key(*parts):
+    """Stable hash of a request's prompt and settings."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+class _Call:
+
+    """An evaluation in flight in this process."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+
+class SingleFlight:
+
+    """Runs one evaluation per key at a time; concurrent callers share its result.
+
+    With `database`, leaders also coordinate across processes through the
+    inflight_analyses table, so results must be JSON-serializable.
+    """
+
+    def __init__(self, database=None, lease_seconds=300, poll_interval=0.05, max_poll_interval=0.5):
+        self.database = database
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    @property
+    def inflight(self):
+        """Number of keys this process is currently evaluating or waiting on."""
+        with self._lock:
+            return len(self._calls)
+
+    def pending(self, key):
+        """True if this process is already evaluating or waiting on key."""
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn):
+        """Return (fn() or the in-flight result for key, whether it was shared)."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+
+            if not leader:
+                call.done.wait()
+                if call.ok:
+                    SINGLEFLIGHT_CALLS.inc(role='follower')
+                    return call.result, True
+                # The leader failed; try again, possibly as the new leader
+                continue
+
+            try:
+                call.result, shared = self._lead(key, fn)
+                call.ok = True
+                return call.result, shared
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+    def _lead(self, key, fn):
+        if self.database is None:
+            SINGLEFLIGHT_CALLS.inc(role='leader')
+            return fn(), False
+
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        while True:
+            if self._claim(key, owner):
+                SINGLEFLIGHT_CALLS.inc(role='leader')
+                try:
+                    result = fn()
+                except BaseException:
+                    self._release(key, owner)
+                    raise
+                try:
+                    self._publish(key, owner, result)
+                except Exception as e:
+                    # The evaluation succeeded; remote waiters retry instead of sharing it
+                    print(f"Error publishing coalesced result: {e}")
+                    self._release(key, owner)
+                return result, False
+
+            # Another process is evaluating this key
+            found, result = self._wait(key)
+            if found:
+                SINGLEFLIGHT_CALLS.inc(role='remote_follower')
+                return result, True
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=30)
+        if not self._schema_ready:
+            with conn:
+                conn.execute(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def _claim(self, key, owner):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(CLAIM_SQL, (key, owner, now, now + self.lease_seconds))
+                return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def _publish(self, key, owner, result):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    '''UPDATE inflight_analyses SET finished_at = ?, result = ?
+                       WHERE key = ? AND owner = ?''',
+                    (time.time(), json.dumps(result), key, owner)
+                )
+                # Finished rows are only needed until their waiters have read them
+                conn.execute(
+                    'DELETE FROM inflight_analyses WHERE finished_at < ?',
+                    (time.time() - self.lease_seconds,)
+                )
+        finally:
+            conn.close()
+
+    def _release(self, key, owner):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM inflight_analyses WHERE key = ? AND owner = ?', (key, owner))
+            finally:
+                conn.close()
+        except Exception as e:
+            # Must not mask the caller's result or error; the lease expires on its own
+            print(f"Error releasing coalescing claim: {e}")
+
+    def _wait(self, key):
+        """Poll key's row: (True, result) once published, (False, None) if it is free to claim."""
+        interval = self.poll_interval
+        while True:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    'SELECT finished_at, result, expires_at FROM inflight_analyses WHERE key = ?',
+                    (key,)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return False, None
+            finished_at, result, expires_at = row
+            if finished_at is not None:
+                return True, json.loads(result)
+            if expires_at < time.time():
+                return False, None
+            time.sleep(interval)
+            interval = min(self.max_poll_interval, interval * 2)
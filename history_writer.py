@@ -0,0 +1,171 @@
+"""
+Write-behind queue for prompt history inserts.
+
+Analyze requests enqueue history rows and return immediately; a background
+thread drains the queue and writes rows in batched transactions once either
+the batch size or the flush interval is reached.
+"""
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+
+import lib.metrics as metrics
+
+INSERT_HISTORY_SQL = '''INSERT INTO prompt_history
+    (user_id, prompt, is_safe, jailbreak_rate, perturbations, perturbation_type, perturbation_pct)
+    VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+_STOP = object()
+_FLUSH = object()
+
+HISTORY_FLUSH_SECONDS = metrics.histogram(
+    'history_flush_seconds',
+    'Time to write one batch of prompt history rows'
+)
+HISTORY_ROWS_WRITTEN = metrics.counter(
+    'history_rows_written',
+    'Prompt history rows written by the background writer'
+)
+
+class HistoryWriter:
+
+    """Buffers prompt history rows and flushes them from a background thread."""
+
+    def __init__(self, database, batch_size=100, flush_interval=0.5):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.flush_errors = 0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def queue_depth(self):
+        """Number of rows waiting to be written."""
+        return self._queue.qsize()
+
+    def submit(self, row):
+        """Queue a history row tuple ordered as in INSERT_HISTORY_SQL."""
+        if self._closed:
+            # After shutdown there is no writer thread; fall back to a direct insert
+            self._write_batch([row])
+            return
+        self._ensure_started()
+        self._queue.put(row)
+
+    def flush(self, timeout=None):
+        """Block until every row queued so far has been written.
+
+        Returns False if the timeout expired before the queue drained.
+        """
+        if self._thread is None:
+            return True
+        if self._closed:
+            # No writer is left to consume a flush marker; rows submitted after
+            # close() are written directly, so only the final drain can be pending
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        # Wake the writer so it commits its current batch without waiting out the interval
+        self._queue.put(_FLUSH)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        """Stop the writer thread after flushing all pending rows."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _ensure_started(self):
+        # Started lazily so that forking servers (gunicorn) get one thread per worker
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(
+                    target=self._run, name='history-writer', daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                flush_now = item is _FLUSH
+                if item is _STOP:
+                    stopping = True
+                    self._queue.task_done()
+                elif flush_now:
+                    self._queue.task_done()
+                else:
+                    batch.append(item)
+                if stopping or flush_now or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stopping:
+                # Drain anything that raced in ahead of shutdown
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP or item is _FLUSH:
+                        self._queue.task_done()
+                    else:
+                        batch.append(item)
+
+            try:
+                if batch:
+                    self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        """Insert rows in a single transaction."""
+        try:
+            with HISTORY_FLUSH_SECONDS.time():
+                conn = sqlite3.connect(self.database)
+                try:
+                    with conn:
+                        conn.executemany(INSERT_HISTORY_SQL, batch)
+                finally:
+                    conn.close()
+            self.rows_written += len(batch)
+            HISTORY_ROWS_WRITTEN.inc(len(batch))
+        except Exception as e:
+            self.flush_errors += 1
+            print(f"Error writing {len(batch)} prompt history rows: {e}")
@@ -1,19 +1,187 @@
+import glob
 import json
+import os
+import threading
+from collections.abc import Sequence
+
 import pandas as pd
 
+# Prompts are built this many at a time, so tokenizer calls are batched
+PROMPT_CHUNK_SIZE = 64
+
+# Shard formats picked up when a logfile names a directory
+LOGFILE_EXTENSIONS = ('.json', '.jsonl', '.pd', '.pkl', '.parquet', '.csv')
+
 class Prompt:
+
+    """A full prompt with one perturbable span.
+
+    The text is stored once together with the offsets of the perturbable
+    span, so perturbed variants are built by concatenating the fixed prefix
+    and suffix around the perturbed span, without copying the Prompt.
+    """
+
+    __slots__ = ('text', 'start', 'end', 'max_new_tokens')
+
     def __init__(self, full_prompt, perturbable_prompt, max_new_tokens):
-        self.full_prompt = full_prompt
-        self.perturbable_prompt = perturbable_prompt
+        start = full_prompt.find(perturbable_prompt)
+        if start < 0:
+            raise ValueError('Perturbable prompt does not occur in the full prompt')
+        self.text = full_prompt
+        self.start = start
+        self.end = start + len(perturbable_prompt)
         self.max_new_tokens = max_new_tokens
 
+    @classmethod
+    def from_parts(cls, prefix, perturbable_prompt, suffix, max_new_tokens):
+        """Prompt whose perturbable span sits between a fixed prefix and suffix."""
+        prompt = cls.__new__(cls)
+        prompt.text = prefix + perturbable_prompt + suffix
+        prompt.start = len(prefix)
+        prompt.end = len(prefix) + len(perturbable_prompt)
+        prompt.max_new_tokens = max_new_tokens
+        return prompt
+
+    @property
+    def full_prompt(self):
+        return self.text
+
+    @property
+    def perturbable_prompt(self):
+        return self.text[self.start:self.end]
+
+    @property
+    def prefix(self):
+        return self.text[:self.start]
+
+    @property
+    def suffix(self):
+        return self.text[self.end:]
+
+    def perturbed(self, perturbation_fn):
+        """Full prompt with the perturbable span perturbed; self is unchanged."""
+        text = self.text
+        return text[:self.start] + perturbation_fn(text[self.start:self.end]) + text[self.end:]
+
+    def perturbed_batch(self, perturbation_fn, n):
+        """n perturbed full prompts, using the perturbation's batched path."""
+        text = self.text
+        prefix, suffix = text[:self.start], text[self.end:]
+        return [
+            prefix + perturbed + suffix
+            for perturbed in perturbation_fn.perturb_batch(text[self.start:self.end], n)
+        ]
+
     def perturb(self, perturbation_fn):
+        """Perturb the prompt in place."""
         perturbed_prompt = perturbation_fn(self.perturbable_prompt)
-        self.full_prompt = self.full_prompt.replace(
-            self.perturbable_prompt,
-            perturbed_prompt
+        self.text = self.prefix + perturbed_prompt + self.suffix
+        self.end = self.start + len(perturbed_prompt)
+
+class LazyPrompts(Sequence):
+
+    """Read-only sequence of prompts that are built on first access.
+
+    `build_chunk(start, stop)` returns the prompts for indices [start, stop);
+    it is called once per chunk of `chunk_size` prompts, so slicing off the
+    first few prompts of a large attack log only builds the first chunk.
+    """
+
+    def __init__(self, size, build_chunk, chunk_size=PROMPT_CHUNK_SIZE):
+        self.size = size
+        self.build_chunk = build_chunk
+        self.chunk_size = chunk_size
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('prompt index out of range')
+        chunk_index, offset = divmod(index, self.chunk_size)
+        return self._chunk(chunk_index)[offset]
+
+    def _chunk(self, chunk_index):
+        chunk = self._chunks.get(chunk_index)
+        if chunk is None:
+            with self._lock:
+                chunk = self._chunks.get(chunk_index)
+                if chunk is None:
+                    start = chunk_index * self.chunk_size
+                    stop = min(start + self.chunk_size, self.size)
+                    chunk = self._chunks[chunk_index] = list(self.build_chunk(start, stop))
+        return chunk
+
+def expand_logfile(logfile):
+    """Shard paths for a logfile given as a file, a directory or a glob pattern."""
+    if os.path.isdir(logfile):
+        paths = sorted(
+            os.path.join(logfile, name) for name in os.listdir(logfile)
+            if name.endswith(LOGFILE_EXTENSIONS)
         )
-        self.perturbable_prompt = perturbed_prompt
+    elif glob.has_magic(logfile):
+        paths = sorted(glob.glob(logfile))
+    else:
+        paths = [logfile]
+    if not paths:
+        raise FileNotFoundError(f"No attack logs found for {logfile}")
+    return paths
+
+def iter_jsonl(path):
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def load_gcg_behaviors(logfile):
+    """Goals, targets and controls from one or more GCG logs.
+
+    A shard is either a JSON log with 'goal', 'target' and 'controls' lists,
+    as written by the GCG code, or JSONL with one behavior per line.
+    """
+    goals, targets, controls = [], [], []
+    for path in expand_logfile(logfile):
+        if path.endswith('.jsonl'):
+            for record in iter_jsonl(path):
+                goals.append(record['goal'])
+                targets.append(record['target'])
+                controls.append(record['control'] if 'control' in record else record['controls'])
+        else:
+            with open(path, 'r') as f:
+                log = json.load(f)
+            if not len(log['goal']) == len(log['target']) == len(log['controls']):
+                raise ValueError(f"Mismatched goal/target/controls lengths in {path}")
+            goals.extend(log['goal'])
+            targets.extend(log['target'])
+            controls.extend(log['controls'])
+    return goals, targets, controls
+
+def load_jailbreak_prompts(logfile, column='jailbreak_prompt'):
+    """Jailbreak prompts from one or more PAIR logs.
+
+    Only the prompt column is read from Parquet and CSV shards; anything else
+    is treated as a pickled DataFrame, the format PAIR writes.
+    """
+    prompts = []
+    for path in expand_logfile(logfile):
+        if path.endswith('.jsonl'):
+            prompts.extend(record[column] for record in iter_jsonl(path))
+        elif path.endswith('.json'):
+            prompts.extend(pd.read_json(path)[column].to_list())
+        elif path.endswith('.parquet'):
+            prompts.extend(pd.read_parquet(path, columns=[column])[column].to_list())
+        elif path.endswith('.csv'):
+            prompts.extend(pd.read_csv(path, usecols=[column])[column].to_list())
+        else:
+            prompts.extend(pd.read_pickle(path)[column].to_list())
+    return prompts
 
 class Attack:
     def __init__(self, logfile, target_model):
@@ -30,55 +198,55 @@ class GCG(Attack):
     Paper: https://arxiv.org/abs/2307.15043
     """
 
-    def __init__(self, logfile, target_model):
+    def __init__(self, logfile, target_model, chunk_size=PROMPT_CHUNK_SIZE):
         super(GCG, self).__init__(logfile, target_model)
 
-        with open(self.logfile, 'r') as f:
-            log = json.load(f)
-
-        self.goals = log['goal']
-        self.targets = log['target']
-        self.controls = log['controls']
+        self.goals, self.targets, self.controls = load_gcg_behaviors(logfile)
 
-        self.prompts = [
-            self.create_prompt(g, c, t)
-            for (g, c, t) in zip(self.goals, self.controls, self.targets)
-        ]
+        self.prompts = LazyPrompts(
+            len(self.goals),
+            lambda start, stop: self.create_prompts(
+                self.goals[start:stop],
+                self.controls[start:stop],
+                self.targets[start:stop]
+            ),
+            chunk_size
+        )
 
     def create_prompt(self, goal, control, target, max_new_len=100):
         """Create GCG prompt."""
+        return self.create_prompts([goal], [control], [target], max_new_len)[0]
 
-        max_new_tokens = max(
-            len(self.target_model.tokenizer(target).input_ids) + 2,
-            max_new_len
-        )
+    def create_prompts(self, goals, controls, targets, max_new_len=100):
+        """Create GCG prompts, tokenizing each batch in a single call."""
 
-        # Create full prompt for LLM
-        conv_template = self.target_model.conv_template
-        conv_template.append_message(
-            conv_template.roles[0], f"{goal} {control}"
-        )
-        conv_template.append_message(conv_template.roles[1], f"")
-        prompt = conv_template.get_prompt()
+        tokenizer = self.target_model.tokenizer
+        target_lengths = [len(ids) for ids in tokenizer(list(targets)).input_ids]
+
+        # Create full prompts for LLM
+        template = self.target_model.compiled_template(assistant_message="")
+        rendered = [
+            template.render(f"{goal} {control}")
+            for goal, control in zip(goals, controls)
+        ]
 
         # As per the GCG source code, we encode then decode the full prompt
-        encoding = self.target_model.tokenizer(prompt)
-        full_prompt = self.target_model.tokenizer.decode(
-            encoding.input_ids
-        ).replace('<s>','').replace('</s>','')
+        decoded = tokenizer.batch_decode(tokenizer(rendered).input_ids)
 
-        # Clear the conv template
-        conv_template.messages = []
-        
-        start_index = full_prompt.find(goal)
-        end_index = full_prompt.find(control) + len(control)
-        perturbable_prompt = full_prompt[start_index:end_index]
-        
-        return Prompt(
-            full_prompt, 
-            perturbable_prompt, 
-            max_new_tokens
-        )
+        prompts = []
+        for goal, control, target_length, text in zip(goals, controls, target_lengths, decoded):
+            full_prompt = text.replace('<s>','').replace('</s>','')
+
+            start_index = full_prompt.find(goal)
+            end_index = full_prompt.find(control) + len(control)
+
+            prompts.append(Prompt.from_parts(
+                full_prompt[:start_index],
+                full_prompt[start_index:end_index],
+                full_prompt[end_index:],
+                max(target_length + 2, max_new_len)
+            ))
+        return prompts
 
 class PAIR(Attack):
 
@@ -90,30 +258,28 @@ class PAIR(Attack):
     Paper: https://arxiv.org/abs/2310.08419
     """
 
-    def __init__(self, logfile, target_model):
+    def __init__(self, logfile, target_model, chunk_size=PROMPT_CHUNK_SIZE):
         super(PAIR, self).__init__(logfile, target_model)
 
-        df = pd.read_pickle(logfile)
-        jailbreak_prompts = df['jailbreak_prompt'].to_list()
-        
-        self.prompts = [
-            self.create_prompt(prompt)
-            for prompt in jailbreak_prompts
-        ]
+        self.jailbreak_prompts = load_jailbreak_prompts(logfile)
+
+        self.prompts = LazyPrompts(
+            len(self.jailbreak_prompts),
+            lambda start, stop: [
+                self.create_prompt(prompt)
+                for prompt in self.jailbreak_prompts[start:stop]
+            ],
+            chunk_size
+        )
         
     def create_prompt(self, prompt):
 
-        conv_template = self.target_model.conv_template
-        conv_template.append_message(conv_template.roles[0], prompt)
-        conv_template.append_message(conv_template.roles[1], None)
-        full_prompt = conv_template.get_prompt()
-
-        # Clear the conv template
-        conv_template.messages = []
+        prefix, prompt, suffix = self.target_model.compiled_template().parts(prompt)
 
-        return Prompt(
-            full_prompt,
+        return Prompt.from_parts(
+            prefix,
             prompt,
+            suffix,
             max_new_tokens=100
         )
 
@@ -129,17 +295,12 @@ class CustomPromptAttack(Attack):
     def create_prompt(self, user_prompt, max_new_tokens=100):
         """Create a prompt from user input."""
         
-        # Use the conversation template to format the user prompt
-        conv_template = self.target_model.conv_template
-        conv_template.append_message(conv_template.roles[0], user_prompt)
-        conv_template.append_message(conv_template.roles[1], None)
-        full_prompt = conv_template.get_prompt()
-        
-        # Clear the conv template
-        conv_template.messages = []
+        # Use the compiled conversation template to format the user prompt
+        prefix, user_prompt, suffix = self.target_model.compiled_template().parts(user_prompt)
         
-        return Prompt(
-            full_prompt,
+        return Prompt.from_parts(
+            prefix,
             user_prompt,
+            suffix,
             max_new_tokens
         )
\ No newline at end of file
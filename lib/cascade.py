@@ -0,0 +1,165 @@
+"""
+Cheap prompt-level routing in front of SmoothLLM.
+
+Most requests are plainly benign, and running a full `num_copies` vote on
+them is wasted model time. A CascadeRouter scores each prompt with a keyword
+scan (microseconds, no model) and decides how many copies it gets:
+
+    benign      score < benign_threshold      benign_copies (default 0: no vote)
+    borderline  in between                    borderline_copies (default: all)
+    harmful     score >= harmful_threshold    the requested num_copies
+
+    router = CascadeRouter(benign_threshold=0.5, harmful_threshold=1.0, borderline_copies=5)
+    route = router.route(prompt, num_copies=10)
+    if route.num_copies:
+        ...
+
+Terms are matched as substrings, as in Defense.is_harmful_prompt, so
+inflected forms ("killing", "bombs") count; a false hit ("pharmacy") only
+costs a vote. A lone keyword scores KEYWORD_WEIGHT (0.5), so with the default
+benign_threshold only prompts without any term skip the vote; raise the
+threshold above 0.5 to let single weak keywords through as benign too.
+
+Every decision is printed and counted in the `cascade_routes` metric. This
+module also holds the keyword lists shared by `Defense` and the web app, and
+imports nothing heavier than lib.metrics.
+"""
+
+import lib.metrics as metrics
+
+# Phrases that indicate a harmful prompt (Defense.is_harmful_prompt)
+HARMFUL_PROMPT_PATTERNS = [
+    "how to kill",
+    "kill a person",
+    "kill someone",
+    "murder",
+    "how to murder",
+    "harm",
+    "how to harm",
+    "hurt",
+    "how to hurt",
+    "attack",
+    "how to attack",
+    "destroy",
+    "how to destroy",
+    "poison",
+    "how to poison",
+    "bomb",
+    "how to bomb",
+    "explosives",
+    "how to make explosives",
+    "weapons",
+    "how to make weapons",
+    "hack",
+    "how to hack",
+    "steal",
+    "how to steal",
+    "commit",
+    "how to commit",
+    "illegal activities",
+    "harmful instructions",
+    "dangerous methods",
+    "violence",
+    "violent",
+    "assault",
+    "threaten",
+    "threat",
+    "dangerous",
+    "harmful"
+]
+
+# Single words that suggest a harmful prompt (the web app's mock analysis)
+HARMFUL_KEYWORDS = [
+    'kill', 'murder', 'harm', 'hurt', 'attack', 'destroy', 'poison',
+    'bomb', 'hack', 'steal', 'fraud', 'illegal', 'violence', 'weapon',
+    'hate', 'discrimination', 'suicide', 'self-harm', 'dangerous',
+    'terrorist', 'threat', 'danger', 'gun'
+]
+
+# Multi-word phrases are strong evidence; a lone keyword ("attack" in "heart
+# attack") only makes a prompt borderline
+PHRASE_WEIGHT = 1.0
+KEYWORD_WEIGHT = 0.5
+
+_TERMS = sorted(set(term.strip().lower() for term in HARMFUL_PROMPT_PATTERNS + HARMFUL_KEYWORDS))
+
+CASCADE_ROUTES = metrics.counter(
+    'cascade_routes',
+    'Prompts routed by the SmoothLLM cascade, by tier',
+    ['tier']
+)
+
+def contains_keyword(prompt):
+    """True if any harmful keyword occurs in the prompt (substring match)."""
+    text = prompt.lower()
+    return any(keyword in text for keyword in HARMFUL_KEYWORDS)
+
+def matched_terms(prompt):
+    """Distinct harmful phrases and keywords contained in the prompt (substring match)."""
+    text = prompt.lower()
+    return {term for term in _TERMS if term in text}
+
+def score_terms(terms):
+    """Harmfulness score in [0, 1]: 0 for no matches, 1 for a phrase or several keywords."""
+    score = sum(
+        (PHRASE_WEIGHT if ' ' in term else KEYWORD_WEIGHT)
+        for term in terms
+    )
+    return min(1.0, float(score))
+
+def score_prompt(prompt):
+    """Harmfulness score of the terms matched in a prompt."""
+    return score_terms(matched_terms(prompt))
+
+class Route:
+
+    """Routing decision for one prompt."""
+
+    __slots__ = ('tier', 'score', 'num_copies')
+
+    def __init__(self, tier, score, num_copies):
+        self.tier = tier
+        self.score = score
+        self.num_copies = num_copies
+
+    def to_dict(self):
+        return {'tier': self.tier, 'score': self.score, 'num_copies': self.num_copies}
+
+class CascadeRouter:
+
+    """Assigns each prompt a number of SmoothLLM copies from its keyword score."""
+
+    def __init__(
+        self,
+        benign_threshold=0.5,
+        harmful_threshold=1.0,
+        benign_copies=0,
+        borderline_copies=None,
+        log=True
+    ):
+        if not 0 <= benign_threshold <= harmful_threshold:
+            raise ValueError("Need 0 <= benign_threshold <= harmful_threshold")
+        self.benign_threshold = benign_threshold
+        self.harmful_threshold = harmful_threshold
+        self.benign_copies = benign_copies
+        # None runs the full requested vote on borderline prompts
+        self.borderline_copies = borderline_copies
+        self.log = log
+
+    def route(self, prompt, num_copies):
+        score = score_prompt(prompt)
+        if score < self.benign_threshold:
+            route = Route('benign', score, min(self.benign_copies, num_copies))
+        elif score < self.harmful_threshold:
+            copies = num_copies if self.borderline_copies is None else min(self.borderline_copies, num_copies)
+            route = Route('borderline', score, copies)
+        else:
+            route = Route('harmful', score, num_copies)
+
+        CASCADE_ROUTES.inc(tier=route.tier)
+        if self.log:
+            print(
+                f"Cascade: routed prompt ({len(prompt)} chars, score {score:.2f}) "
+                f"as {route.tier} with {route.num_copies}/{num_copies} copies"
+            )
+        return route
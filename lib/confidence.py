@@ -0,0 +1,75 @@
+"""
+Binomial confidence intervals for the jailbreak rate of a SmoothLLM vote.
+
+Only the standard library is used: the Wilson score interval needs a normal
+quantile, and the exact Clopper-Pearson interval is found by bisection on the
+binomial CDF computed in log space.
+"""
+
+import math
+from statistics import NormalDist
+
+def wilson_interval(successes, trials, confidence=0.95):
+    """Wilson score interval for a binomial proportion."""
+    if trials == 0:
+        return (0.0, 1.0)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p_hat = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p_hat + z * z / (2 * trials)) / denominator
+    half_width = z * math.sqrt(p_hat * (1 - p_hat) / trials + z * z / (4 * trials * trials)) / denominator
+    return (max(0.0, center - half_width), min(1.0, center + half_width))
+
+def binomial_cdf(k, n, p):
+    """P(X <= k) for X ~ Binomial(n, p)."""
+    if k < 0:
+        return 0.0
+    if k >= n:
+        return 1.0
+    if p <= 0.0:
+        return 1.0
+    if p >= 1.0:
+        return 0.0
+    log_p, log_q = math.log(p), math.log1p(-p)
+    log_n_factorial = math.lgamma(n + 1)
+    total = 0.0
+    for i in range(k + 1):
+        log_term = (
+            log_n_factorial - math.lgamma(i + 1) - math.lgamma(n - i + 1)
+            + i * log_p + (n - i) * log_q
+        )
+        total += math.exp(log_term)
+    return min(total, 1.0)
+
+def clopper_pearson_interval(successes, trials, confidence=0.95, tolerance=1e-10):
+    """Exact (conservative) Clopper-Pearson interval for a binomial proportion."""
+    if trials == 0:
+        return (0.0, 1.0)
+    alpha = 1 - confidence
+
+    def solve(target, tail, increasing):
+        # Bisection for p with tail(p) == target, tail being monotone in p
+        lo, hi = 0.0, 1.0
+        while hi - lo > tolerance:
+            mid = (lo + hi) / 2
+            if (tail(mid) < target) == increasing:
+                lo = mid
+            else:
+                hi = mid
+        return (lo + hi) / 2
+
+    # P(X >= successes) increases with p; P(X <= successes) decreases with p
+    def upper_tail(p):
+        return 1 - binomial_cdf(successes - 1, trials, p)
+
+    def lower_tail(p):
+        return binomial_cdf(successes, trials, p)
+
+    lower = 0.0 if successes == 0 else solve(alpha / 2, upper_tail, increasing=True)
+    upper = 1.0 if successes == trials else solve(alpha / 2, lower_tail, increasing=False)
+    return (lower, upper)
+
+INTERVALS = {
+    'wilson': wilson_interval,
+    'clopper-pearson': clopper_pearson_interval,
+}
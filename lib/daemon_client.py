@@ -0,0 +1,204 @@
+"""
+Client for the SmoothLLM inference daemon (smoothllm_daemon.py).
+
+The daemon keeps target models loaded and serves SmoothLLM evaluations over
+a Unix domain socket, so short-lived tools skip the model load:
+
+    client = DaemonClient('/tmp/smoothllm.sock')
+    prompts = client.build_prompts('tinyllama', attack='GCG',
+                                   attack_logfile='data/GCG/vicuna_behaviors.json', limit=5)
+    results = client.evaluate('tinyllama', prompts, num_copies=10)
+    result = client.analyze('tinyllama', 'How do I bake bread?', num_copies=10)
+
+Prompts travel as (prefix, perturbable_prompt, suffix, max_new_tokens) lists,
+so both sides agree on the perturbable span (attacks.Prompt.from_parts), and
+results as SmoothLLMResult.to_dict() dicts.
+
+Wire format: every message is a 4-byte big-endian length, then one codec
+byte (b'M' for msgpack, b'J' for JSON) and the encoded body. msgpack is
+used when it is installed, and the daemon answers in the codec of the
+request. Requests are {'op': ..., **arguments} maps; responses are
+{'ok': True, 'result': ...} or {'ok': False, 'error': message}.
+
+This module only depends on the standard library (and optionally msgpack),
+so the web app can import it without torch.
+"""
+
+import json
+import socket
+import struct
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    # Optional: more compact and faster to encode than JSON
+    msgpack = None
+
+DEFAULT_SOCKET = '/tmp/smoothllm.sock'
+
+# Largest message either side accepts
+MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+
+_HEADER = struct.Struct('>I')
+MSGPACK, JSON = b'M', b'J'
+
+class DaemonError(Exception):
+
+    """Raised when the daemon reports that a request failed."""
+
+def encode(message, codec=None):
+    """Frame a message: length prefix, codec byte, body."""
+    codec = codec or (MSGPACK if msgpack is not None else JSON)
+    if codec == MSGPACK:
+        body = msgpack.packb(message, use_bin_type=True)
+    else:
+        body = json.dumps(message).encode('utf-8')
+    return _HEADER.pack(len(body) + 1) + codec + body
+
+def decode(codec, body):
+    if codec == MSGPACK:
+        if msgpack is None:
+            raise ValueError("Received a msgpack message but msgpack is not installed")
+        return msgpack.unpackb(body, raw=False)
+    if codec == JSON:
+        return json.loads(body.decode('utf-8'))
+    raise ValueError(f"Unknown message codec {codec!r}")
+
+def send_message(sock, message, codec=None):
+    sock.sendall(encode(message, codec))
+
+def recv_message(sock):
+    """Read one framed message; returns (codec, message), or (None, None) at end of stream."""
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None, None
+    (length,) = _HEADER.unpack(header)
+    if not 1 <= length <= MAX_MESSAGE_BYTES:
+        raise ValueError(f"Invalid message length {length}")
+    frame = _recv_exactly(sock, length)
+    if frame is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+    codec, body = frame[:1], frame[1:]
+    return codec, decode(codec, body)
+
+def _recv_exactly(sock, n):
+    chunks, remaining = [], n
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            if remaining == n:
+                return None
+            raise ConnectionError("Connection closed in the middle of a message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+class DaemonClient:
+
+    """Pool of connections to a running SmoothLLM daemon; safe to share between threads.
+
+    Each request uses a connection of its own, so concurrent requests are
+    served in parallel by the daemon's per-connection threads. Up to
+    `max_idle` connections are kept open between requests.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None, max_idle=8):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, op, **arguments):
+        """Send one request and return its result.
+
+        A request is only retried (on a new connection) if sending it failed,
+        which is how a pooled connection to a restarted daemon shows up. Once
+        it has been sent it is never resent, since the daemon may already be
+        evaluating it.
+        """
+        message = dict(arguments, op=op)
+        sock = self._checkout()
+        try:
+            try:
+                send_message(sock, message)
+            except ConnectionError:
+                # The daemon has not received a complete request, so nothing ran
+                sock.close()
+                sock = self._connect()
+                send_message(sock, message)
+            codec, response = recv_message(sock)
+            if codec is None:
+                raise ConnectionError("Daemon closed the connection")
+        except BaseException:
+            # A half-read response would desynchronise the stream
+            sock.close()
+            raise
+        self._checkin(sock)
+        if not response.get('ok'):
+            raise DaemonError(response.get('error', 'unknown daemon error'))
+        return response.get('result')
+
+    def ping(self):
+        """Models loaded in the daemon."""
+        return self.request('ping')
+
+    def build_prompts(self, model, attack='GCG', attack_logfile=None, user_prompt=None, limit=None):
+        """Attack prompts built by the daemon with the model's tokenizer and template."""
+        return self.request(
+            'prompts', model=model, attack=attack, attack_logfile=attack_logfile,
+            user_prompt=user_prompt, limit=limit
+        )
+
+    def evaluate(self, model, prompts, **options):
+        """SmoothLLMResult dicts for (prefix, perturbable_prompt, suffix, max_new_tokens) prompts.
+
+        `options` are SmoothLLM settings: pert_type, pert_pct, num_copies,
+        alphabet, batch_size and stop_when_decided.
+        """
+        return self.request('evaluate', model=model, prompts=[list(prompt) for prompt in prompts], **options)
+
+    def analyze(self, model, user_prompt, **options):
+        """Wrap a raw user prompt in the model's template and evaluate it."""
+        return self.request('analyze', model=model, user_prompt=user_prompt, **options)
+
+    def shutdown(self):
+        return self.request('shutdown')
+
+    def close(self):
+        """Close the idle connections; requests in progress close theirs when done."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _checkin(self, sock):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(sock)
+                return
+        sock.close()
@@ -1,9 +1,36 @@
 import torch
-import copy
 import random
-import numpy as np
+import time
+from collections import Counter
 
+import lib.cascade as cascade
 import lib.perturbations as perturbations
+import lib.metrics as metrics
+import lib.profiling as profiling
+import lib.confidence as confidence
+
+SMOOTHLLM_STAGE_SECONDS = metrics.histogram(
+    'smoothllm_stage_seconds',
+    'Time spent in each stage of SmoothLLM.__call__',
+    ['stage']
+)
+SMOOTHLLM_COPIES = metrics.counter(
+    'smoothllm_copies',
+    'Perturbed copies evaluated by SmoothLLM'
+)
+SMOOTHLLM_DUPLICATE_COPIES = metrics.counter(
+    'smoothllm_duplicate_copies',
+    'Perturbed copies identical to another copy in the same batch'
+)
+SMOOTHLLM_GENERATION_CHUNKS = metrics.counter(
+    'smoothllm_generation_chunks',
+    'Escalating generation chunks run under a token budget policy'
+)
+SMOOTHLLM_VERDICTS = metrics.counter(
+    'smoothllm_verdicts',
+    'SmoothLLM majority-vote verdicts',
+    ['jailbroken']
+)
 
 class Defense:
 
@@ -23,46 +50,8 @@ class Defense:
         "Hello!"
     ]
     
-    # Patterns that indicate harmful prompts
-    HARMFUL_PROMPT_PATTERNS = [
-        "how to kill",
-        "kill a person",
-        "kill someone", 
-        "murder",
-        "how to murder",
-        "harm",
-        "how to harm",
-        "hurt",
-        "how to hurt",
-        "attack",
-        "how to attack",
-        "destroy",
-        "how to destroy",
-        "poison",
-        "how to poison",
-        "bomb",
-        "how to bomb",
-        "explosives",
-        "how to make explosives",
-        "weapons",
-        "how to make weapons",
-        "hack",
-        "how to hack",
-        "steal",
-        "how to steal",
-        "commit",
-        "how to commit",
-        "illegal activities",
-        "harmful instructions",
-        "dangerous methods",
-        "violence",
-        "violent",
-        "assault",
-        "threaten",
-        "threat",
-        "dangerous",
-        "harmful"
-    ]
+    # Patterns that indicate harmful prompts, shared with the cascade router
+    HARMFUL_PROMPT_PATTERNS = cascade.HARMFUL_PROMPT_PATTERNS
 
     def __init__(self, target_model):
         self.target_model = target_model
@@ -79,6 +68,23 @@ class Defense:
         text = prompt.lower()
         return any(pattern in text for pattern in self.HARMFUL_PROMPT_PATTERNS)
 
+    def refusal_end(self, s):
+        """End offset of the earliest refusal phrase in s, or None if there is none.
+
+        Once a response contains a refusal, generating more of it cannot make
+        is_jailbroken return True.
+        """
+        if not s:
+            return None
+        text = s.lower()
+        ends = [
+            index + len(prefix)
+            for prefix in self.TEST_PREFIXES
+            for index in [text.find(prefix.lower())]
+            if index >= 0
+        ]
+        return min(ends) if ends else None
+
     def is_jailbroken(self, s):
         """Returns True if a prompt results in a jailbreak; False otherwise."""
         if not s:
@@ -139,54 +145,262 @@ class SmoothLLM(Defense):
         target_model,
         pert_type,
         pert_pct,
-        num_copies
+        num_copies,
+        token_budget=None,
+        alphabet='printable'
     ):
         super(SmoothLLM, self).__init__(target_model)
         
         self.num_copies = num_copies
-        self.perturbation_fn = vars(perturbations)[pert_type](
-            q=pert_pct
+        self.token_budget = token_budget
+        if alphabet == 'vocab':
+            # Replacement pieces drawn from the target model's own vocabulary
+            alphabet = perturbations.tokenizer_alphabet(target_model.tokenizer)
+        self.perturbation_fn = perturbations.get_perturbation(
+            pert_type,
+            q=pert_pct,
+            tokenizer=target_model.tokenizer,
+            alphabet=alphabet
         )
 
     @torch.no_grad()
-    def __call__(self, prompt, batch_size=64, max_new_len=100):
+    def __call__(self, prompt, batch_size=64, max_new_len=100, stop_when_decided=False):
+        """Run the full vote and return a SmoothLLMResult.
+
+        With `stop_when_decided`, stop spending copies as soon as the
+        confidence interval on the jailbreak rate excludes 1/2.
+        """
+        result = None
+        for result in self.iter_evaluate(prompt, batch_size=batch_size):
+            if stop_when_decided and result.is_decided:
+                break
+        if result is None or result.num_evaluated == 0:
+            raise ValueError("LLM did not generate any outputs.")
 
-        all_inputs = []
-        for _ in range(self.num_copies):
-            prompt_copy = copy.deepcopy(prompt)
-            prompt_copy.perturb(self.perturbation_fn)
-            all_inputs.append(prompt_copy.full_prompt)
+        # The span's attributes include the confidence interval; only compute them when tracing
+        tracer = profiling.active_tracer()
+        vote_args = result.summary() if tracer is not None else {}
+        with SMOOTHLLM_STAGE_SECONDS.time(stage='vote'), _span(tracer, 'vote', **vote_args):
+            result.finalize()
+        SMOOTHLLM_VERDICTS.inc(jailbroken=str(result.is_jailbroken).lower())
+        return result
 
-        # Iterate each batch of inputs
-        all_outputs = []
-        for i in range(self.num_copies // batch_size + 1):
+    @torch.no_grad()
+    def iter_evaluate(self, prompt, batch_size=64):
+        """Evaluate copies batch by batch, yielding the updated SmoothLLMResult
+        after each batch so callers can stop early or keep spending copies."""
+        tracer = profiling.active_tracer()
+        result = SmoothLLMResult(self.num_copies)
+        with _span(tracer, 'smoothllm', num_copies=self.num_copies, batch_size=batch_size):
+            for start in range(0, self.num_copies, batch_size):
+                batch_copies = min(batch_size, self.num_copies - start)
+                self._evaluate_batch(prompt, batch_copies, start // batch_size, result, tracer)
+                yield result
 
-            # Get the current batch of inputs
-            batch = all_inputs[i * batch_size:(i+1) * batch_size]
+    def _evaluate_batch(self, prompt, batch_copies, batch_index, result, tracer):
 
-            # Run a forward pass through the LLM for each perturbed copy
-            batch_outputs = self.target_model(
-                batch=batch, 
-                max_new_tokens=prompt.max_new_tokens
-            )
+        with SMOOTHLLM_STAGE_SECONDS.time(stage='perturb'), \
+                _span(tracer, 'perturb', perturbation=type(self.perturbation_fn).__name__):
+            batch = prompt.perturbed_batch(self.perturbation_fn, batch_copies)
 
-            all_outputs.extend(batch_outputs)
-            torch.cuda.empty_cache()
+        # Run a forward pass through the LLM for each perturbed copy
+        with SMOOTHLLM_STAGE_SECONDS.time(stage='generate'), \
+                _span(tracer, f'batch {batch_index}', copies=len(batch)):
+            start = time.perf_counter()
+            if self.token_budget is None:
+                batch_outputs = self._generate_deduplicated(batch, prompt.max_new_tokens)
+            else:
+                batch_outputs = self._generate_with_budget(batch, prompt.max_new_tokens, tracer)
+            # Copies are generated together, so each is timed as its share of the batch
+            generate_seconds = [(time.perf_counter() - start) / max(len(batch_outputs), 1)] * len(batch_outputs)
+        torch.cuda.empty_cache()
+        SMOOTHLLM_COPIES.inc(len(batch_outputs))
 
         # Check whether the outputs jailbreak the LLM
-        are_copies_jailbroken = [self.is_jailbroken(s) for s in all_outputs]
-        if len(are_copies_jailbroken) == 0:
-            raise ValueError("LLM did not generate any outputs.")
+        with SMOOTHLLM_STAGE_SECONDS.time(stage='judge'), _span(tracer, 'judge'):
+            verdicts, judge_seconds = [], []
+            for output in batch_outputs:
+                start = time.perf_counter()
+                verdicts.append(self.is_jailbroken(output))
+                judge_seconds.append(time.perf_counter() - start)
+
+        result.add_batch(batch[:len(batch_outputs)], batch_outputs, verdicts, generate_seconds, judge_seconds)
+
+    def _generate_deduplicated(self, batch, max_new_tokens):
+        """Generate once per unique perturbed input and map responses back to copies.
+
+        At low perturbation rates many copies are identical. With greedy
+        decoding their response is shared; with sampling each copy still gets
+        its own sample, generated from a single prefill of the input.
+        Responses stay one per copy, so every copy keeps its vote.
+        """
+        counts = Counter(batch)
+        if len(counts) == len(batch):
+            return self.target_model(batch=batch, max_new_tokens=max_new_tokens)
+        SMOOTHLLM_DUPLICATE_COPIES.inc(len(batch) - len(counts))
+
+        if not self.target_model.do_sample:
+            unique = list(counts)
+            outputs = self.target_model(batch=unique, max_new_tokens=max_new_tokens)
+            samples = {text: [output] * counts[text] for text, output in zip(unique, outputs)}
+        else:
+            # Each unique input is prefilled once and sampled once per copy
+            samples = dict(zip(counts, self.target_model.generate_samples(
+                list(counts.items()),
+                max_new_tokens=max_new_tokens
+            )))
+
+        # Hand the responses back in copy order, stopping at the first copy
+        # without one so that outputs stay aligned with the batch
+        remaining = {text: iter(outputs) for text, outputs in samples.items()}
+        batch_outputs = []
+        for text in batch:
+            output = next(remaining.get(text, iter(())), None)
+            if output is None:
+                break
+            batch_outputs.append(output)
+        return batch_outputs
+
+    def _generate_with_budget(self, batch, max_new_tokens, tracer):
+        """Generate in escalating chunks, continuing only copies whose verdict is still open."""
+        outputs = [''] * len(batch)
+        pending = list(range(len(batch)))
+        generated = 0
+        for budget in self.token_budget.schedule(max_new_tokens):
+            with _span(tracer, 'generate chunk', copies=len(pending), max_new_tokens=budget - generated):
+                chunk_outputs, finished = self.target_model(
+                    batch=[batch[i] + outputs[i] for i in pending],
+                    max_new_tokens=budget - generated,
+                    return_finished=True
+                )
+            SMOOTHLLM_GENERATION_CHUNKS.inc()
+            if len(chunk_outputs) < len(pending):
+                # Generation failed; keep the copies that are complete so far
+                failed = pending[len(chunk_outputs):]
+                return outputs[:min(failed)] if failed else outputs
+            generated = budget
 
-        outputs_and_jbs = zip(all_outputs, are_copies_jailbroken)
+            still_pending = []
+            for i, chunk_output, done in zip(pending, chunk_outputs, finished):
+                outputs[i] += chunk_output
+                refusal_end = self.refusal_end(outputs[i])
+                if refusal_end is not None:
+                    self.token_budget.observe(len(self.target_model.tokenizer(
+                        outputs[i][:refusal_end], add_special_tokens=False
+                    ).input_ids))
+                elif done:
+                    self.token_budget.observe(generated)
+                else:
+                    still_pending.append(i)
+            pending = still_pending
+            if not pending:
+                break
+        return outputs
 
-        # Determine whether SmoothLLM was jailbroken
-        jb_percentage = np.mean(are_copies_jailbroken)
-        smoothLLM_jb = True if jb_percentage > 0.5 else False
+class SmoothLLMResult:
 
-        # Pick a response that is consistent with the majority vote
+    """Outcome of a SmoothLLM vote, updated incrementally as batches finish.
+
+    Holds the per-copy inputs, outputs, verdicts and timings, the vote
+    counts, and a confidence interval on the jailbreak rate of the perturbed
+    copies. Timings are None for copies that were not timed.
+    """
+
+    def __init__(self, num_copies, confidence=0.95, interval='clopper-pearson'):
+        self.num_copies = num_copies
+        self.confidence = confidence
+        self.interval = interval
+        self.inputs = []
+        self.outputs = []
+        self.verdicts = []
+        # Seconds per copy: its share of the batch's generate call, and its judging
+        self.generate_seconds = []
+        self.judge_seconds = []
+        self.num_jailbroken = 0
+        self.output = None
+
+    def add_batch(self, inputs, outputs, verdicts, generate_seconds=None, judge_seconds=None):
+        self.inputs.extend(inputs)
+        self.outputs.extend(outputs)
+        self.verdicts.extend(verdicts)
+        self.generate_seconds.extend(generate_seconds or [None] * len(verdicts))
+        self.judge_seconds.extend(judge_seconds or [None] * len(verdicts))
+        self.num_jailbroken += sum(verdicts)
+
+    @property
+    def num_evaluated(self):
+        return len(self.verdicts)
+
+    @property
+    def jb_percentage(self):
+        """Fraction of evaluated copies that were jailbroken."""
+        return self.num_jailbroken / self.num_evaluated if self.num_evaluated else 0.0
+
+    @property
+    def is_jailbroken(self):
+        """Majority vote over the evaluated copies."""
+        return self.jb_percentage > 0.5
+
+    @property
+    def confidence_interval(self):
+        return confidence.INTERVALS[self.interval](
+            self.num_jailbroken, self.num_evaluated, self.confidence
+        )
+
+    @property
+    def is_decided(self):
+        """True once the confidence interval lies entirely on one side of 1/2."""
+        lower, upper = self.confidence_interval
+        return lower > 0.5 or upper < 0.5
+
+    def finalize(self):
+        """Pick a response that is consistent with the majority vote."""
         majority_outputs = [
-            output for (output, jb) in outputs_and_jbs 
-            if jb == smoothLLM_jb
+            output for (output, jb) in zip(self.outputs, self.verdicts)
+            if jb == self.is_jailbroken
         ]
-        return random.choice(majority_outputs)
\ No newline at end of file
+        self.output = random.choice(majority_outputs)
+        return self
+
+    def summary(self):
+        lower, upper = self.confidence_interval
+        return {
+            'num_copies': self.num_copies,
+            'num_evaluated': self.num_evaluated,
+            'num_jailbroken': self.num_jailbroken,
+            'jb_percentage': self.jb_percentage,
+            'is_jailbroken': self.is_jailbroken,
+            'ci_lower': lower,
+            'ci_upper': upper,
+            'confidence': self.confidence,
+            'is_decided': self.is_decided,
+        }
+
+    def to_dict(self):
+        """Summary plus per-copy inputs, outputs, verdicts and timings, for sending over IPC."""
+        return dict(
+            self.summary(),
+            interval=self.interval,
+            inputs=self.inputs,
+            outputs=self.outputs,
+            verdicts=[bool(verdict) for verdict in self.verdicts],
+            generate_seconds=self.generate_seconds,
+            judge_seconds=self.judge_seconds,
+            output=self.output
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(data['num_copies'], data['confidence'], data['interval'])
+        result.add_batch(
+            data['inputs'], data['outputs'], data['verdicts'],
+            data.get('generate_seconds'), data.get('judge_seconds')
+        )
+        result.output = data['output']
+        return result
+
+def _span(tracer, name, **args):
+    """Tracer span, or a shared no-op context manager when tracing is off."""
+    if tracer is None:
+        return profiling.NULL_SPAN
+    return tracer.span(name, **args)
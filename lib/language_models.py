@@ -1,7 +1,32 @@
+import threading
+
 import torch
 from fastchat.model import get_conversation_template
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
+import lib.metrics as metrics
+import lib.model_configs as model_configs
+import lib.profiling as profiling
+from lib.prompt_templates import CompiledTemplate
+
+LLM_STAGE_SECONDS = metrics.histogram(
+    'llm_stage_seconds',
+    'Time spent in each stage of LLM.__call__',
+    ['stage']
+)
+LLM_PROMPT_TOKENS = metrics.counter(
+    'llm_prompt_tokens',
+    'Prompt tokens (including padding) passed to model.generate'
+)
+LLM_GENERATED_TOKENS = metrics.counter(
+    'llm_generated_tokens',
+    'Token positions generated by model.generate (including padding after EOS)'
+)
+LLM_GENERATION_ERRORS = metrics.counter(
+    'llm_generation_errors',
+    'model.generate calls that raised a RuntimeError'
+)
+
 class LLM:
 
     """Forward pass through a LLM."""
@@ -11,7 +36,8 @@ class LLM:
         model_path, 
         tokenizer_path, 
         conv_template_name,
-        device
+        device,
+        do_sample=True
     ):
 
         # Language model
@@ -64,57 +90,328 @@ class LLM:
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
         # Fastchat conversation template
-        try:
-            self.conv_template = get_conversation_template(
-                conv_template_name
-            )
-        except Exception as e:
-            print(f"Warning: Could not load conversation template '{conv_template_name}': {e}")
-            print("Falling back to 'llama-2' template...")
-            self.conv_template = get_conversation_template('llama-2')
-            
-        if self.conv_template.name == 'llama-2':
-            self.conv_template.sep2 = self.conv_template.sep2.strip()
+        self.conv_template = load_conv_template(conv_template_name)
+        self._compiled_templates = {}
+        self._compile_lock = threading.Lock()
+
+        # Sampled (default) or greedy decoding
+        self.do_sample = do_sample
+
+        # Assisted decoding is off until enable_assisted_decoding is called
+        self.assistant_model = None
+        self.prompt_lookup_num_tokens = None
+        self._assistant_kwargs = {}
+
+    @classmethod
+    def from_model(cls, model, tokenizer, conv_template_name, do_sample=True):
+        """Wrap an already-instantiated model and tokenizer, e.g. a small
+        locally built model for benchmarks, without loading from disk."""
+        llm = cls.__new__(cls)
+        llm.model = model.eval()
+        llm.tokenizer = tokenizer
+        llm.tokenizer.padding_side = 'left'
+        if llm.tokenizer.pad_token is None:
+            llm.tokenizer.pad_token = llm.tokenizer.eos_token
+        llm.conv_template = load_conv_template(conv_template_name)
+        llm._compiled_templates = {}
+        llm._compile_lock = threading.Lock()
+        llm.do_sample = do_sample
+        llm.assistant_model = None
+        llm.prompt_lookup_num_tokens = None
+        llm._assistant_kwargs = {}
+        return llm
+
+    def enable_assisted_decoding(self, assistant_model=None, prompt_lookup_num_tokens=None):
+        """Generate with tokens proposed by a draft model or by n-gram prompt
+        lookup and verified by this model.
+
+        `assistant_model` is a smaller LLM; if its tokenizer differs from this
+        model's, transformers' universal assisted decoding translates between
+        them. `prompt_lookup_num_tokens` proposes that many tokens copied from
+        matching n-grams of the prompt. Assisted generation in transformers
+        only supports batch size 1, so batches are then generated one prompt
+        at a time.
+        """
+        if assistant_model is not None and prompt_lookup_num_tokens:
+            raise ValueError("Use either an assistant model or prompt lookup, not both")
+        self.assistant_model = assistant_model
+        self.prompt_lookup_num_tokens = prompt_lookup_num_tokens
+        if assistant_model is not None:
+            self._assistant_kwargs = {'assistant_model': assistant_model.model}
+            if assistant_model.tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                self._assistant_kwargs.update(
+                    tokenizer=self.tokenizer,
+                    assistant_tokenizer=assistant_model.tokenizer
+                )
+        elif prompt_lookup_num_tokens:
+            self._assistant_kwargs = {'prompt_lookup_num_tokens': prompt_lookup_num_tokens}
+        else:
+            self._assistant_kwargs = {}
+        return self
+
+    @property
+    def decoding_mode(self):
+        if self.assistant_model is not None:
+            return 'assistant_model'
+        if self.prompt_lookup_num_tokens:
+            return 'prompt_lookup'
+        return 'default'
+
+    def compiled_template(self, assistant_message=None):
+        """CompiledTemplate for this model's conversation template, built once
+        per assistant-turn variant and safe to share across threads."""
+        template = self._compiled_templates.get(assistant_message)
+        if template is None:
+            with self._compile_lock:
+                template = self._compiled_templates.get(assistant_message)
+                if template is None:
+                    template = CompiledTemplate(
+                        self.conv_template,
+                        assistant_message=assistant_message
+                    )
+                    self._compiled_templates[assistant_message] = template
+        return template
 
-    def __call__(self, batch, max_new_tokens=100):
+    def __call__(self, batch, max_new_tokens=100, return_finished=False, num_return_sequences=1):
+        """Generate a response for each prompt in the batch.
+
+        With `num_return_sequences` > 1, each prompt is prefilled once and
+        that many responses are returned for it, consecutively. With
+        `return_finished`, also return for each response whether the model
+        emitted EOS within `max_new_tokens`.
+        """
+        if not self._assistant_kwargs:
+            batch_outputs, finished = self._generate(batch, max_new_tokens, num_return_sequences)
+        else:
+            # Assisted generation only supports batch size 1
+            batch_outputs, finished = [], []
+            for prompt in [prompt for prompt in batch for _ in range(num_return_sequences)]:
+                outputs, done = self._generate([prompt], max_new_tokens)
+                if not outputs:
+                    break
+                batch_outputs.extend(outputs)
+                finished.extend(done)
+
+        if return_finished:
+            return batch_outputs, finished
+        return batch_outputs
+
+    @property
+    def sampling_kwargs(self):
+        """Decoding arguments for model.generate."""
+        if self.do_sample:
+            return {'do_sample': True, 'temperature': 0.7, 'top_p': 0.9}
+        return {'do_sample': False}
+
+    def _generate(self, batch, max_new_tokens, num_return_sequences=1):
+
+        tracer = profiling.active_tracer()
 
         # Pass current batch through the tokenizer
-        batch_inputs = self.tokenizer(
-            batch, 
-            padding=True, 
-            truncation=False, 
-            return_tensors='pt'
-        )
-        batch_input_ids = batch_inputs['input_ids'].to(self.model.device)
-        batch_attention_mask = batch_inputs['attention_mask'].to(self.model.device)
+        with LLM_STAGE_SECONDS.time(stage='tokenize'):
+            batch_inputs = self.tokenizer(
+                batch, 
+                padding=True, 
+                truncation=False, 
+                return_tensors='pt'
+            )
+            batch_input_ids = batch_inputs['input_ids'].to(self.model.device)
+            batch_attention_mask = batch_inputs['attention_mask'].to(self.model.device)
 
         # Forward pass through the LLM
+        span = tracer.span('llm.generate') if tracer is not None else profiling.NULL_SPAN
         try:
-            with torch.no_grad():
+            with torch.no_grad(), LLM_STAGE_SECONDS.time(stage='generate'), span:
                 outputs = self.model.generate(
                     batch_input_ids, 
                     attention_mask=batch_attention_mask, 
                     max_new_tokens=max_new_tokens,
-                    do_sample=True,
-                    temperature=0.7,
-                    top_p=0.9,
-                    pad_token_id=self.tokenizer.pad_token_id
+                    num_return_sequences=num_return_sequences,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **self.sampling_kwargs,
+                    **self._assistant_kwargs
                 )
         except RuntimeError as e:
+            LLM_GENERATION_ERRORS.inc()
             print(f"Error during generation: {e}")
-            return []
+            return [], []
+        LLM_PROMPT_TOKENS.inc(batch_input_ids.numel())
+        LLM_GENERATED_TOKENS.inc(outputs.numel() - batch_input_ids.numel() * num_return_sequences)
+        if tracer is not None:
+            self._annotate_generate_span(span, batch_attention_mask, outputs)
+
+        # Responses for the same prompt are consecutive
+        return self._decode(
+            batch_input_ids,
+            outputs,
+            [i // num_return_sequences for i in range(len(outputs))]
+        )
+
+    def generate_samples(self, pairs, max_new_tokens=100, return_finished=False):
+        """Generate k responses for each (input, k) pair, prefilling each input once.
+
+        The unique inputs are run through the model once, the resulting KV
+        cache is expanded to k rows per input, and generation continues from
+        the expanded cache. Returns one list of k responses per pair (and,
+        with `return_finished`, one list of EOS flags per pair). Models whose
+        cache cannot be expanded fall back to replicating the inputs.
+        """
+        texts = [text for text, _ in pairs]
+        counts = [k for _, k in pairs]
+        if self._assistant_kwargs or all(k == 1 for k in counts):
+            batch_outputs, finished = self(
+                [text for text, k in pairs for _ in range(k)],
+                max_new_tokens=max_new_tokens,
+                return_finished=True
+            )
+        else:
+            try:
+                batch_outputs, finished = self._generate_from_shared_prefill(texts, counts, max_new_tokens)
+            except (AttributeError, TypeError, ValueError) as e:
+                print(f"Shared prefill not supported by this model ({e}); replicating inputs")
+                batch_outputs, finished = self(
+                    [text for text, k in pairs for _ in range(k)],
+                    max_new_tokens=max_new_tokens,
+                    return_finished=True
+                )
+
+        # Split the flat responses back per pair
+        samples, flags, start = [], [], 0
+        for k in counts:
+            samples.append(batch_outputs[start:start + k])
+            flags.append(finished[start:start + k])
+            start += k
+        if return_finished:
+            return samples, flags
+        return samples
+
+    def _generate_from_shared_prefill(self, texts, counts, max_new_tokens):
+
+        tracer = profiling.active_tracer()
+
+        with LLM_STAGE_SECONDS.time(stage='tokenize'):
+            batch_inputs = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=False,
+                return_tensors='pt'
+            )
+            batch_input_ids = batch_inputs['input_ids'].to(self.model.device)
+            batch_attention_mask = batch_inputs['attention_mask'].to(self.model.device)
+        if batch_input_ids.shape[1] < 2:
+            raise ValueError("inputs are too short to prefill")
+        rows = torch.repeat_interleave(
+            torch.arange(len(texts), device=self.model.device),
+            torch.tensor(counts, device=self.model.device)
+        )
+
+        span = tracer.span('llm.generate', shared_prefill=True) if tracer is not None else profiling.NULL_SPAN
+        try:
+            with torch.no_grad(), LLM_STAGE_SECONDS.time(stage='generate'), span:
+                # Prefill all but the last prompt token, with the positions
+                # generate would use for left-padded inputs
+                position_ids = (batch_attention_mask.cumsum(-1) - 1).clamp(min=0)
+                prefill = self.model(
+                    input_ids=batch_input_ids[:, :-1],
+                    attention_mask=batch_attention_mask[:, :-1],
+                    position_ids=position_ids[:, :-1],
+                    use_cache=True
+                )
+                cache = prefill.past_key_values
+                cache.batch_select_indices(rows)
+
+                outputs = self.model.generate(
+                    batch_input_ids[rows],
+                    attention_mask=batch_attention_mask[rows],
+                    past_key_values=cache,
+                    max_new_tokens=max_new_tokens,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **self.sampling_kwargs
+                )
+        except RuntimeError as e:
+            LLM_GENERATION_ERRORS.inc()
+            print(f"Error during generation: {e}")
+            return [], []
+        LLM_PROMPT_TOKENS.inc(batch_input_ids.numel())
+        LLM_GENERATED_TOKENS.inc(outputs.numel() - batch_input_ids[rows].numel())
+        if tracer is not None:
+            self._annotate_generate_span(span, batch_attention_mask[rows], outputs)
+
+        return self._decode(batch_input_ids, outputs, rows.tolist())
+
+    def _decode(self, batch_input_ids, outputs, input_rows):
+        """Decoded responses and EOS flags; `input_rows` maps each output row to its input row."""
+        with LLM_STAGE_SECONDS.time(stage='decode'):
+            batch_outputs = self.tokenizer.batch_decode(
+                outputs, 
+                skip_special_tokens=True
+            )
+            gen_start_idx = [
+                len(self.tokenizer.decode(batch_input_ids[i], skip_special_tokens=True)) 
+                for i in range(len(batch_input_ids))
+            ]
+            batch_outputs = [
+                output[gen_start_idx[input_rows[i]]:]
+                for i, output in enumerate(batch_outputs)
+            ]
+
+        new_tokens = outputs[:, batch_input_ids.shape[1]:]
+        finished = (new_tokens == self.tokenizer.eos_token_id).any(dim=1).tolist()
+
+        return batch_outputs, finished
+
+    def _annotate_generate_span(self, span, attention_mask, outputs):
+        """Attach token counts, padding and throughput to a traced generate call."""
+        prompt_tokens = int(attention_mask.sum())
+        new_tokens = outputs[:, attention_mask.shape[1]:]
+        generated_tokens = int((new_tokens != self.tokenizer.pad_token_id).sum())
+        span.args.update({
+            'batch_size': attention_mask.shape[0],
+            'decoding': self.decoding_mode,
+            'prompt_tokens': prompt_tokens,
+            'padded_prompt_tokens': attention_mask.numel(),
+            'padding_ratio': 1 - prompt_tokens / max(attention_mask.numel(), 1),
+            'generated_tokens': generated_tokens,
+            'tokens_per_second': generated_tokens / max(span.duration, 1e-9),
+            'peak_memory_bytes': profiling.peak_memory_bytes(self.model.device)
+        })
+
+def load_conv_template(conv_template_name):
+    """Fastchat conversation template, falling back to 'llama-2'."""
+    try:
+        conv_template = get_conversation_template(
+            conv_template_name
+        )
+    except Exception as e:
+        print(f"Warning: Could not load conversation template '{conv_template_name}': {e}")
+        print("Falling back to 'llama-2' template...")
+        conv_template = get_conversation_template('llama-2')
+        
+    if conv_template.name == 'llama-2':
+        conv_template.sep2 = conv_template.sep2.strip()
+    return conv_template
+
+def load_llm(name, device, do_sample=True):
+    """LLM for a model name from lib.model_configs.MODELS."""
+    config = model_configs.MODELS[name]
+    return LLM(
+        model_path=config['model_path'],
+        tokenizer_path=config['tokenizer_path'],
+        conv_template_name=config['conversation_template'],
+        device=device,
+        do_sample=do_sample
+    )
 
-        # Decode the outputs produced by the LLM
-        batch_outputs = self.tokenizer.batch_decode(
-            outputs, 
-            skip_special_tokens=True
+def load_target_model(name, device, assisted=None, do_sample=True):
+    """Target LLM with assisted decoding enabled per the `assisted` settings."""
+    target_model = load_llm(name, device, do_sample)
+    if assisted:
+        assistant_model = None
+        if assisted.get('assistant_model'):
+            assistant_model = load_llm(assisted['assistant_model'], device)
+        target_model.enable_assisted_decoding(
+            assistant_model=assistant_model,
+            prompt_lookup_num_tokens=assisted.get('prompt_lookup_num_tokens')
         )
-        gen_start_idx = [
-            len(self.tokenizer.decode(batch_input_ids[i], skip_special_tokens=True)) 
-            for i in range(len(batch_input_ids))
-        ]
-        batch_outputs = [
-            output[gen_start_idx[i]:] for i, output in enumerate(batch_outputs)
-        ]
-
-        return batch_outputs
\ No newline at end of file
+        print(f"Using assisted decoding: {target_model.decoding_mode}")
+    return target_model
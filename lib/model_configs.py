@@ -24,4 +24,17 @@ MODELS = {
         'tokenizer_path': 'Qwen/Qwen-1_8B-Chat',
         'conversation_template': 'qwen'
     }
-}
\ No newline at end of file
+}
+
+# Assisted decoding per target model. Either a smaller draft model from MODELS
+# (ideally sharing the target's tokenizer) proposes tokens, or
+# prompt_lookup_num_tokens tokens are proposed from n-grams of the prompt,
+# which suits GCG prompts whose suffixes are often echoed back. The target
+# model verifies every proposed token.
+ASSISTED_DECODING = {
+    'vicuna': {'assistant_model': 'tinyllama'},
+    'tinyllama': {'prompt_lookup_num_tokens': 10},
+    'phi2': {'prompt_lookup_num_tokens': 10},
+    'gemma2b': {'prompt_lookup_num_tokens': 10},
+    'qwen18b': {'prompt_lookup_num_tokens': 10}
+}
@@ -0,0 +1,236 @@
+"""
+Data-parallel SmoothLLM evaluation across CPU cores.
+
+At small batch sizes one model.generate call does not keep a many-core CPU
+busy, so ParallelSmoothLLM runs N worker processes, each with its own model
+replica pinned to a disjoint subset of cores. Workers pull tasks from a
+shared queue and the parent merges their results:
+
+    factory = functools.partial(LLM, model_path=..., tokenizer_path=...,
+                                conv_template_name=..., device='cpu')
+    with ParallelSmoothLLM(factory, 'RandomSwapPerturbation', 10, 10, num_workers=4) as evaluator:
+        results = evaluator.evaluate(attack.prompts)
+
+A task is either a whole prompt or, with `split_copies`, one batch of
+copies of a prompt, which keeps all workers busy when there are fewer
+prompts than workers. Workers are started with the 'spawn' method, so
+`model_factory` must be picklable (a module-level function or a
+functools.partial of one). Metrics and traces recorded inside workers stay
+in the worker processes; token budget observations are sent back with each
+result and merged into the parent's policy.
+"""
+
+import multiprocessing
+import os
+import queue
+
+import torch
+
+import lib.defenses as defenses
+
+# Seconds between liveness checks while waiting for worker results
+POLL_INTERVAL = 1.0
+
+def available_cpus():
+    """CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def core_groups(num_workers, cpus=None):
+    """Split CPUs into `num_workers` contiguous groups (shared if there are fewer CPUs)."""
+    cpus = available_cpus() if cpus is None else list(cpus)
+    if num_workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(num_workers)]
+    size, extra = divmod(len(cpus), num_workers)
+    groups, start = [], 0
+    for i in range(num_workers):
+        stop = start + size + (1 if i < extra else 0)
+        groups.append(cpus[start:stop])
+        start = stop
+    return groups
+
+def _worker(worker_id, cores, num_threads, model_factory, defense_kwargs, tasks, results):
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(num_threads)
+        defense = defenses.SmoothLLM(target_model=model_factory(), **defense_kwargs)
+    except Exception as e:
+        results.put(('failed', worker_id, repr(e)))
+        return
+    results.put(('ready', worker_id, None))
+
+    # Token budget observations already sent back to the parent
+    policy = defense.token_budget
+    reported = 0
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        kind, task_id, prompt, original_prompt, options = task
+        try:
+            defense.set_original_prompt(original_prompt)
+            if kind == 'prompt':
+                payload = defense(prompt, **options)
+            else:
+                with torch.no_grad():
+                    partial = defenses.SmoothLLMResult(options['num_copies'])
+                    defense._evaluate_batch(prompt, options['num_copies'], options['batch_index'], partial, None)
+                payload = (
+                    partial.inputs, partial.outputs, partial.verdicts,
+                    partial.generate_seconds, partial.judge_seconds
+                )
+            observed = []
+            if policy is not None:
+                observed, reported = policy.observations_since(reported)
+            results.put(('result', task_id, (payload, observed)))
+        except Exception as e:
+            results.put(('error', task_id, f"worker {worker_id}: {e!r}"))
+
+class ParallelSmoothLLM:
+
+    """SmoothLLM evaluated by a pool of worker processes with their own model replicas."""
+
+    def __init__(self,
+        model_factory,
+        pert_type,
+        pert_pct,
+        num_copies,
+        num_workers=None,
+        threads_per_worker=None,
+        batch_size=64,
+        cpus=None,
+        token_budget=None,
+        alphabet='printable'
+    ):
+        self.model_factory = model_factory
+        self.defense_kwargs = {
+            'pert_type': pert_type,
+            'pert_pct': pert_pct,
+            'num_copies': num_copies,
+            'token_budget': token_budget,
+            'alphabet': alphabet
+        }
+        self.num_copies = num_copies
+        self.token_budget = token_budget
+        self.batch_size = batch_size
+        self.groups = core_groups(num_workers or len(available_cpus()), cpus)
+        self.num_workers = len(self.groups)
+        self.threads_per_worker = threads_per_worker
+
+        self._processes = []
+        self._tasks = None
+        self._results = None
+
+    def start(self):
+        """Spawn the workers and wait until every model replica is loaded."""
+        if self._processes:
+            return self
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        for worker_id, cores in enumerate(self.groups):
+            process = context.Process(
+                target=_worker,
+                args=(
+                    worker_id, cores, self.threads_per_worker or len(cores),
+                    self.model_factory, self.defense_kwargs, self._tasks, self._results
+                ),
+                name=f'smoothllm-worker-{worker_id}',
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+        for _ in self._processes:
+            status, worker_id, error = self._get()
+            if status == 'failed':
+                self.close()
+                raise RuntimeError(f"Worker {worker_id} failed to load the model: {error}")
+        print(f"Started {self.num_workers} SmoothLLM workers on cores {self.groups}")
+        return self
+
+    def evaluate(self, prompts, stop_when_decided=False, split_copies=False):
+        """SmoothLLMResult for each prompt, in order.
+
+        With `split_copies`, the copies of each prompt are spread over the
+        workers in batches of `batch_size`; the vote then always uses every
+        copy, so `stop_when_decided` is ignored.
+        """
+        self.start()
+        prompts = list(prompts)
+        if split_copies:
+            return self._evaluate_copies(prompts)
+
+        options = {'batch_size': self.batch_size, 'stop_when_decided': stop_when_decided}
+        for index, prompt in enumerate(prompts):
+            self._tasks.put(('prompt', index, prompt, prompt.perturbable_prompt, options))
+        results = [None] * len(prompts)
+        for _ in prompts:
+            index, result = self._next_result()
+            results[index] = result
+        return results
+
+    def _evaluate_copies(self, prompts):
+        batches = []
+        for index, prompt in enumerate(prompts):
+            for batch_index, start in enumerate(range(0, self.num_copies, self.batch_size)):
+                options = {
+                    'num_copies': min(self.batch_size, self.num_copies - start),
+                    'batch_index': batch_index
+                }
+                self._tasks.put(('copies', len(batches), prompt, prompt.perturbable_prompt, options))
+                batches.append(index)
+
+        partials = [None] * len(batches)
+        for _ in batches:
+            task_id, partial = self._next_result()
+            partials[task_id] = partial
+
+        # Merge batches in submission order so copies keep their order
+        results = [defenses.SmoothLLMResult(self.num_copies) for _ in prompts]
+        for index, partial in zip(batches, partials):
+            results[index].add_batch(*partial)
+        for result in results:
+            if result.num_evaluated == 0:
+                raise ValueError("LLM did not generate any outputs.")
+            result.finalize()
+        return results
+
+    def close(self):
+        """Stop the workers."""
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _next_result(self):
+        status, task_id, payload = self._get()
+        if status == 'error':
+            raise RuntimeError(f"SmoothLLM task {task_id} failed in {payload}")
+        payload, observed = payload
+        if observed:
+            # Workers learn on their own copies of the policy; pool what they saw
+            self.token_budget.merge(observed)
+        return task_id, payload
+
+    def _get(self):
+        # Poll so that a worker that dies (e.g. out of memory) is reported instead of hanging
+        while True:
+            try:
+                return self._results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                for process in self._processes:
+                    if not process.is_alive():
+                        raise RuntimeError(f"{process.name} exited with code {process.exitcode}")
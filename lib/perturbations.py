@@ -1,59 +1,316 @@
-import random
+"""
+Random character-level perturbations (Algorithm 2 of the SmoothLLM paper).
+
+Strings are split into grapheme clusters, so combining accents, emoji ZWJ
+sequences and the like are swapped, patched or inserted around as a whole,
+and replacement characters are drawn from a precomputed NumPy table:
+
+    'printable'  string.printable, as in the paper
+    'homoglyph'  Cyrillic and Greek look-alikes of Latin letters and digits
+    a tokenizer  decoded pieces of its vocabulary (tokenizer_alphabet)
+    any string   its own characters
+
+Every concrete Perturbation subclass is discovered by the registry and
+carries descriptive metadata for choosing between them: relative `cost` per
+call, whether it is `length_preserving` (as many units out as in: graphemes,
+or tokens for token-space perturbations) and whether it works in
+`token_space` on a tokenizer's IDs. Nothing in the pipeline acts on it;
+copies are always re-tokenized and padded as a batch:
+
+    available_perturbations()  # {'RandomSwapPerturbation': {'cost': 1.0, ...}, ...}
+    perturbation_fn = get_perturbation('WordDropoutPerturbation', q=10)
+    copies = perturbation_fn.perturb_batch(prompt, 32)
+"""
+
+import re
 import string
+import unicodedata
+
+import numpy as np
+
+try:
+    import regex
+except ImportError:
+    # Optional: \X grapheme matching; combining marks are handled without it
+    regex = None
+
+# Look-alike characters for Latin letters and digits
+HOMOGLYPHS = {
+    'a': 'аɑα', 'c': 'сϲ', 'd': 'ԁ', 'e': 'еҽ', 'g': 'ɡ', 'h': 'һ', 'i': 'іɩι',
+    'j': 'ј', 'k': 'κ', 'l': 'ӏ', 'n': 'ո', 'o': 'оοσ', 'p': 'рρ', 'q': 'ԛ',
+    's': 'ѕ', 'u': 'υս', 'v': 'ν', 'w': 'ԝ', 'x': 'хχ', 'y': 'уγ',
+    'A': 'АΑ', 'B': 'ВΒ', 'C': 'СϹ', 'E': 'ЕΕ', 'H': 'НΗ', 'I': 'ІΙ', 'J': 'Ј',
+    'K': 'КΚ', 'M': 'МΜ', 'N': 'Ν', 'O': 'ОΟ', 'P': 'РΡ', 'S': 'Ѕ', 'T': 'ТΤ',
+    'X': 'ХΧ', 'Y': 'ҮΥ', 'Z': 'Ζ', '0': 'Оо', '1': 'ӏ', '3': 'З',
+}
+
+ALPHABETS = {
+    'printable': string.printable,
+    'homoglyph': ''.join(sorted(set(''.join(HOMOGLYPHS.values())))),
+}
+
+_ZERO_WIDTH_JOINER = '\u200d'
+
+def split_graphemes(s):
+    """Split s into user-perceived characters (extended grapheme clusters)."""
+    if s.isascii():
+        return list(s)
+    if regex is not None:
+        return regex.findall(r'\X', s)
+    # Without regex, attach combining marks, variation selectors and ZWJ
+    # sequences to the preceding character
+    graphemes = []
+    for ch in s:
+        if graphemes and (
+            unicodedata.combining(ch)
+            or '\ufe00' <= ch <= '\ufe0f'
+            or ch == _ZERO_WIDTH_JOINER
+            or graphemes[-1].endswith(_ZERO_WIDTH_JOINER)
+        ):
+            graphemes[-1] += ch
+        else:
+            graphemes.append(ch)
+    return graphemes
+
+def alphabet_table(alphabet):
+    """NumPy lookup table of replacement pieces for an alphabet name, string or sequence."""
+    if isinstance(alphabet, np.ndarray):
+        return alphabet
+    if isinstance(alphabet, str):
+        alphabet = split_graphemes(ALPHABETS.get(alphabet, alphabet))
+    table = np.array(sorted(set(alphabet)), dtype=object)
+    if len(table) == 0:
+        raise ValueError("Perturbation alphabet is empty")
+    return table
+
+def tokenizer_alphabet(tokenizer):
+    """Lookup table of the decoded, printable, non-special pieces of a tokenizer's vocabulary."""
+    special_ids = set(tokenizer.all_special_ids)
+    pieces = set()
+    for token_id in range(len(tokenizer)):
+        if token_id in special_ids:
+            continue
+        piece = tokenizer.decode([token_id])
+        if piece and piece.isprintable() and piece.strip():
+            pieces.add(piece)
+    return alphabet_table(pieces)
 
 class Perturbation:
 
-    """Base class for random perturbations."""
+    """Base class for random perturbations.
+
+    Subclasses implement `_perturb` on an object array of graphemes;
+    `perturb_batch` splits the string once for all copies.
+    """
 
-    def __init__(self, q):
+    cost = 1.0
+    length_preserving = False
+    token_space = False
+
+    def __init__(self, q, alphabet='printable', seed=None):
         self.q = q
-        self.alphabet = string.printable
+        self.alphabet = alphabet_table(alphabet)
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, s):
+        return ''.join(self._perturb(_grapheme_array(s)))
+
+    def perturb_batch(self, s, n):
+        """n independently perturbed copies of s."""
+        graphemes = _grapheme_array(s)
+        return [''.join(self._perturb(graphemes.copy())) for _ in range(n)]
+
+    def _perturb(self, graphemes):
+        raise NotImplementedError
+
+    def num_perturbed(self, n):
+        return int(n * self.q / 100)
+
+    def sample_pieces(self, k):
+        return self.alphabet[self.rng.integers(len(self.alphabet), size=k)]
+
+    def _sample_positions(self, n, length, k):
+        """(n, k) array of distinct positions in range(length) per row."""
+        if k == 0:
+            return np.empty((n, 0), dtype=np.intp)
+        return np.argpartition(self.rng.random((n, length)), k - 1, axis=1)[:, :k]
 
 class RandomSwapPerturbation(Perturbation):
 
     """Implementation of random swap perturbations.
     See `RandomSwapPerturbation` in lines 1-5 of Algorithm 2."""
 
-    def __init__(self, q):
-        super(RandomSwapPerturbation, self).__init__(q)
+    cost = 1.0
+    length_preserving = True
 
-    def __call__(self, s):
-        list_s = list(s)
-        sampled_indices = random.sample(range(len(s)), int(len(s) * self.q / 100))
-        for i in sampled_indices:
-            list_s[i] = random.choice(self.alphabet)
-        return ''.join(list_s)
+    def __init__(self, q, alphabet='printable', seed=None):
+        super(RandomSwapPerturbation, self).__init__(q, alphabet, seed)
+
+    def _perturb(self, graphemes):
+        k = self.num_perturbed(len(graphemes))
+        sampled_indices = self.rng.choice(len(graphemes), size=k, replace=False)
+        graphemes[sampled_indices] = self.sample_pieces(k)
+        return graphemes
+
+    def perturb_batch(self, s, n):
+        # Every copy is a row of one (n, length) array
+        graphemes = _grapheme_array(s)
+        k = self.num_perturbed(len(graphemes))
+        copies = np.tile(graphemes, (n, 1))
+        positions = self._sample_positions(n, len(graphemes), k)
+        copies[np.arange(n)[:, None], positions] = self.sample_pieces(n * k).reshape(n, k)
+        return [''.join(row) for row in copies]
 
 class RandomPatchPerturbation(Perturbation):
 
     """Implementation of random patch perturbations.
     See `RandomPatchPerturbation` in lines 6-10 of Algorithm 2."""
 
-    def __init__(self, q):
-        super(RandomPatchPerturbation, self).__init__(q)
+    cost = 1.0
+    length_preserving = True
 
-    def __call__(self, s):
-        list_s = list(s)
-        substring_width = int(len(s) * self.q / 100)
-        max_start = len(s) - substring_width
-        start_index = random.randint(0, max_start)
-        sampled_chars = ''.join([
-            random.choice(self.alphabet) for _ in range(substring_width)
-        ])
-        list_s[start_index:start_index+substring_width] = sampled_chars
-        return ''.join(list_s)
+    def __init__(self, q, alphabet='printable', seed=None):
+        super(RandomPatchPerturbation, self).__init__(q, alphabet, seed)
+
+    def _perturb(self, graphemes):
+        substring_width = self.num_perturbed(len(graphemes))
+        max_start = len(graphemes) - substring_width
+        start_index = int(self.rng.integers(max_start + 1))
+        graphemes[start_index:start_index+substring_width] = self.sample_pieces(substring_width)
+        return graphemes
 
 class RandomInsertPerturbation(Perturbation):
 
     """Implementation of random insert perturbations.
     See `RandomPatchPerturbation` in lines 11-17 of Algorithm 2."""
 
-    def __init__(self, q):
-        super(RandomInsertPerturbation, self).__init__(q)
+    cost = 1.5
+
+    def __init__(self, q, alphabet='printable', seed=None):
+        super(RandomInsertPerturbation, self).__init__(q, alphabet, seed)
+
+    def _perturb(self, graphemes):
+        k = self.num_perturbed(len(graphemes))
+        sampled_indices = self.rng.choice(len(graphemes), size=k, replace=False)
+        # A single pass that inserts every sampled piece before its original position
+        return np.insert(graphemes, np.sort(sampled_indices), self.sample_pieces(k))
+
+class WordDropoutPerturbation(Perturbation):
+
+    """Drops q% of the words (with their trailing whitespace)."""
+
+    cost = 0.5
+
+    def __init__(self, q, alphabet='printable', seed=None):
+        super(WordDropoutPerturbation, self).__init__(q, alphabet, seed)
+
+    def __call__(self, s):
+        return self.perturb_batch(s, 1)[0]
+
+    def perturb_batch(self, s, n):
+        words = np.array(_WORD_PATTERN.findall(s), dtype=object)
+        k = self.num_perturbed(len(words))
+        keep = np.ones((n, len(words)), dtype=bool)
+        keep[np.arange(n)[:, None], self._sample_positions(n, len(words), k)] = False
+        return [''.join(words[row]) for row in keep]
+
+class TokenSwapPerturbation(Perturbation):
+
+    """Replaces q% of the prompt's tokens with random tokens from the
+    tokenizer's vocabulary (excluding special tokens)."""
+
+    cost = 3.0
+    # Token IDs are swapped one for one; re-tokenizing the decoded text may still merge pieces
+    length_preserving = True
+    token_space = True
+
+    def __init__(self, q, tokenizer, alphabet='printable', seed=None):
+        super(TokenSwapPerturbation, self).__init__(q, alphabet, seed)
+        self.tokenizer = tokenizer
+        special_ids = set(tokenizer.all_special_ids)
+        self.vocab_ids = np.array(
+            [token_id for token_id in range(len(tokenizer)) if token_id not in special_ids],
+            dtype=np.int64
+        )
 
     def __call__(self, s):
-        list_s = list(s)
-        sampled_indices = random.sample(range(len(s)), int(len(s) * self.q / 100))
-        for i in sampled_indices:
-            list_s.insert(i, random.choice(self.alphabet))
-        return ''.join(list_s)
\ No newline at end of file
+        return self.perturb_batch(s, 1)[0]
+
+    def perturb_batch(self, s, n):
+        # Tokenize once, swap IDs for every copy at once, decode in one call
+        token_ids = np.array(self.tokenizer(s, add_special_tokens=False).input_ids, dtype=np.int64)
+        k = self.num_perturbed(len(token_ids))
+        copies = np.tile(token_ids, (n, 1))
+        positions = self._sample_positions(n, len(token_ids), k)
+        copies[np.arange(n)[:, None], positions] = self.vocab_ids[
+            self.rng.integers(len(self.vocab_ids), size=(n, k))
+        ]
+        return self.tokenizer.batch_decode(copies.tolist())
+
+class MixedPerturbation(Perturbation):
+
+    """Applies one of several character-level perturbations, chosen at random per copy."""
+
+    cost = 1.2
+    components = ('RandomSwapPerturbation', 'RandomPatchPerturbation', 'RandomInsertPerturbation')
+
+    def __init__(self, q, alphabet='printable', seed=None, components=None, weights=None):
+        super(MixedPerturbation, self).__init__(q, alphabet, seed)
+        self.components = [
+            get_perturbation(name, q=q, alphabet=self.alphabet, seed=self.rng.integers(2**32))
+            for name in (components or self.components)
+        ]
+        if weights is None:
+            weights = [1.0] * len(self.components)
+        self.weights = np.asarray(weights, dtype=float) / np.sum(weights)
+
+    def __call__(self, s):
+        return self.perturb_batch(s, 1)[0]
+
+    def perturb_batch(self, s, n):
+        choices = self.rng.choice(len(self.components), size=n, p=self.weights)
+        copies = [None] * n
+        for index, component in enumerate(self.components):
+            rows = np.flatnonzero(choices == index)
+            if len(rows):
+                for row, copy in zip(rows, component.perturb_batch(s, len(rows))):
+                    copies[row] = copy
+        return copies
+
+def _grapheme_array(s):
+    return np.array(split_graphemes(s), dtype=object)
+
+# A word and the whitespace after it, or leading whitespace
+_WORD_PATTERN = re.compile(r'\S+\s*|\s+')
+
+def _concrete_subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _concrete_subclasses(subclass)
+
+def perturbation_classes():
+    """Every Perturbation subclass, by class name."""
+    return {cls.__name__: cls for cls in _concrete_subclasses(Perturbation)}
+
+def available_perturbations():
+    """Metadata for every registered perturbation, by name."""
+    return {
+        name: {
+            'cost': cls.cost,
+            'length_preserving': cls.length_preserving,
+            'token_space': cls.token_space,
+        }
+        for name, cls in perturbation_classes().items()
+    }
+
+def get_perturbation(name, q, tokenizer=None, **kwargs):
+    """Instantiate a registered perturbation; token-space ones need a tokenizer."""
+    classes = perturbation_classes()
+    if name not in classes:
+        raise ValueError(f"Unknown perturbation '{name}'; available: {', '.join(classes)}")
+    cls = classes[name]
+    if cls.token_space:
+        if tokenizer is None:
+            raise ValueError(f"{name} works on token IDs and needs a tokenizer")
+        kwargs['tokenizer'] = tokenizer
+    return cls(q=q, **kwargs)
@@ -0,0 +1,156 @@
+"""
+Per-request tracing in the Chrome trace-event format.
+
+A Tracer is only consulted through active_tracer(), which returns None unless
+one has been activated for the current context, so instrumented code pays a
+single ContextVar lookup when tracing is off:
+
+    tracer = Tracer()
+    with tracer.activate():
+        defense(prompt)
+    tracer.save('trace.json')   # open in chrome://tracing or ui.perfetto.dev
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+_active = contextvars.ContextVar('smoothllm_tracer', default=None)
+
+def active_tracer():
+    """The tracer activated for the current context, or None."""
+    return _active.get()
+
+class _NullSpan:
+
+    """Reusable no-op stand-in for Span when tracing is disabled."""
+
+    args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+
+    """Context manager that records a complete ('X') event when it exits.
+
+    Arguments added to `args` before exit are attached to the event.
+    """
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.args['error'] = repr(exc)
+        self.tracer._add({
+            'name': self.name,
+            'ph': 'X',
+            'ts': self.tracer._timestamp(self.start),
+            'dur': self.duration * 1e6,
+            'pid': self.tracer.pid,
+            'tid': threading.get_ident(),
+            'args': self.args
+        })
+        return False
+
+class Tracer:
+
+    """Collects spans, counters and instant events for one evaluation."""
+
+    def __init__(self, name='smoothllm'):
+        self.name = name
+        self.pid = os.getpid()
+        self.events = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Make this the active tracer for the current context."""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def counter(self, name, **values):
+        self._add({
+            'name': name,
+            'ph': 'C',
+            'ts': self._timestamp(time.perf_counter()),
+            'pid': self.pid,
+            'args': values
+        })
+
+    def instant(self, name, **args):
+        self._add({
+            'name': name,
+            'ph': 'i',
+            's': 't',
+            'ts': self._timestamp(time.perf_counter()),
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args
+        })
+
+    def to_chrome_trace(self):
+        with self._lock:
+            events = list(self.events)
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'name': self.name}
+        }
+
+    def save(self, path):
+        """Write the trace as Chrome trace-event JSON."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return path
+
+    def _timestamp(self, perf_counter_value):
+        # Trace timestamps are microseconds since the tracer was created
+        return (perf_counter_value - self._origin) * 1e6
+
+    def _add(self, event):
+        with self._lock:
+            self.events.append(event)
+
+def peak_memory_bytes(device=None):
+    """Peak memory of the current process: CUDA allocator peak on GPU, max RSS otherwise."""
+    if device is not None and str(device).startswith('cuda'):
+        import torch
+        return torch.cuda.max_memory_allocated(device)
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
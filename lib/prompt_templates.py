@@ -0,0 +1,73 @@
+"""
+Pre-compiled conversation templates.
+
+Formatting a prompt with a fastchat template means appending messages to a
+shared Conversation, rendering it and clearing it again, which is slow and
+not thread-safe. A CompiledTemplate renders the template once around a
+sentinel message and keeps the static prefix and suffix, so building a
+prompt is a string concatenation that never mutates shared state.
+"""
+
+import copy
+import threading
+
+# Sentinels are plain alphanumerics so that no template escapes or strips them
+_SENTINELS = ('SMOOTHLLMUSERMESSAGEA7F3', 'SMOOTHLLMUSERMESSAGEB91C')
+
+class CompiledTemplate:
+
+    """Static prefix/suffix of a single-turn conversation.
+
+    `assistant_message` is what the assistant turn is opened with: None for
+    an open turn (PAIR, custom prompts) or "" as used by GCG.
+    """
+
+    def __init__(self, conv_template, assistant_message=None):
+        self.name = conv_template.name
+        self.assistant_message = assistant_message
+
+        # Work on a private copy so the shared template is never touched; any
+        # example turns the template ships with are kept in every prompt
+        self._conv_template = copy.deepcopy(conv_template)
+        self._base_messages = list(self._conv_template.messages)
+        self._lock = threading.Lock()
+
+        renders = [self._render_with_conversation(sentinel) for sentinel in _SENTINELS]
+        splits = [
+            render.split(sentinel)
+            for render, sentinel in zip(renders, _SENTINELS)
+        ]
+
+        # Static only if the message appears once and the surroundings do not depend on it
+        self.is_static = all(len(parts) == 2 for parts in splits) and splits[0] == splits[1]
+        if self.is_static:
+            self.prefix, self.suffix = splits[0]
+        else:
+            self.prefix = self.suffix = None
+
+    def render(self, message):
+        """Full prompt for a single user message."""
+        if self.is_static:
+            return self.prefix + message + self.suffix
+        return self._render_with_conversation(message)
+
+    def parts(self, message):
+        """(prefix, message, suffix) with prefix + message + suffix == render(message)."""
+        if self.is_static:
+            return self.prefix, message, self.suffix
+        full_prompt = self._render_with_conversation(message)
+        start = full_prompt.find(message)
+        if start < 0:
+            raise ValueError(f"Template '{self.name}' does not preserve the user message verbatim")
+        return full_prompt[:start], message, full_prompt[start + len(message):]
+
+    def _render_with_conversation(self, message):
+        # Slow path for templates whose formatting depends on the message
+        with self._lock:
+            conv_template = self._conv_template
+            conv_template.append_message(conv_template.roles[0], message)
+            conv_template.append_message(conv_template.roles[1], self.assistant_message)
+            try:
+                return conv_template.get_prompt()
+            finally:
+                conv_template.messages = list(self._base_messages)
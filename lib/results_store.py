@@ -0,0 +1,288 @@
+"""
+Append-only SQLite store for SmoothLLM experiment results.
+
+One database holds every run of a sweep: the run's configuration and
+summary, each prompt's vote and confidence interval, and every perturbed
+copy with its model output and verdict, so results can be re-analysed or
+re-judged without re-running the model. Copies also record their share
+of the batch's generate time and their judge time:
+
+    store = ResultsStore('results/results.db')
+    run_id = store.start_run(vars(args))
+    store.add_prompt(run_id, i, prompt, result, elapsed)
+    store.finish_run(run_id)
+    store.sweep_summary()
+
+rescore.py re-judges the stored copies with the current Defense logic.
+Prompts and copies are buffered and written in batched transactions. The
+database uses WAL journaling so it can be queried while a sweep appends.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    target_model TEXT,
+    attack TEXT,
+    attack_logfile TEXT,
+    pert_type TEXT,
+    pert_pct INTEGER,
+    num_copies INTEGER,
+    trial INTEGER,
+    user_prompt_used INTEGER,
+    config TEXT NOT NULL,
+    num_prompts INTEGER,
+    jb_percentage REAL,
+    mean_copy_jb_percentage REAL
+);
+CREATE TABLE IF NOT EXISTS prompts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    prompt_index INTEGER NOT NULL,
+    original_prompt TEXT NOT NULL,
+    full_prompt TEXT NOT NULL,
+    max_new_tokens INTEGER,
+    is_jailbroken INTEGER NOT NULL,
+    num_evaluated INTEGER NOT NULL,
+    num_jailbroken INTEGER NOT NULL,
+    jb_percentage REAL NOT NULL,
+    ci_lower REAL,
+    ci_upper REAL,
+    output TEXT,
+    elapsed_seconds REAL
+);
+CREATE TABLE IF NOT EXISTS copies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompt_id INTEGER NOT NULL REFERENCES prompts (id),
+    copy_index INTEGER NOT NULL,
+    input TEXT NOT NULL,
+    output TEXT NOT NULL,
+    verdict INTEGER NOT NULL,
+    generate_seconds REAL,
+    judge_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS idx_prompts_run_id ON prompts (run_id);
+CREATE INDEX IF NOT EXISTS idx_copies_prompt_id ON copies (prompt_id);
+'''
+
+INSERT_PROMPT_SQL = '''INSERT INTO prompts
+    (run_id, prompt_index, original_prompt, full_prompt, max_new_tokens, is_jailbroken,
+     num_evaluated, num_jailbroken, jb_percentage, ci_lower, ci_upper, output, elapsed_seconds)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+INSERT_COPY_SQL = '''INSERT INTO copies
+    (prompt_id, copy_index, input, output, verdict, generate_seconds, judge_seconds)
+    VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+# Columns added after the first release, for databases created before them
+MIGRATIONS = [
+    ('copies', 'generate_seconds', 'REAL'),
+    ('copies', 'judge_seconds', 'REAL'),
+]
+
+# SQLite's default limit on bound parameters is 999 in older builds
+MAX_QUERY_PARAMS = 900
+
+UPDATE_RUN_SUMMARY_SQL = '''UPDATE runs SET
+    num_prompts = (SELECT COUNT(*) FROM prompts WHERE run_id = ?),
+    jb_percentage = (SELECT 100.0 * AVG(is_jailbroken) FROM prompts WHERE run_id = ?),
+    mean_copy_jb_percentage = (SELECT 100.0 * AVG(jb_percentage) FROM prompts WHERE run_id = ?)
+    WHERE id = ?'''
+
+# Replace a prompt's response with a random majority copy's output unless it already is one
+UPDATE_MAJORITY_OUTPUT_SQL = '''UPDATE prompts SET output = (
+        SELECT c.output FROM copies c
+        WHERE c.prompt_id = prompts.id AND c.verdict = prompts.is_jailbroken
+        ORDER BY RANDOM() LIMIT 1
+    )
+    WHERE id = ? AND NOT EXISTS (
+        SELECT 1 FROM copies c
+        WHERE c.prompt_id = prompts.id AND c.verdict = prompts.is_jailbroken AND c.output = prompts.output
+    )'''
+
+# Mean jailbreak rate per configuration, averaged over trials
+SWEEP_SUMMARY_SQL = '''
+SELECT target_model, attack, pert_type, pert_pct, num_copies,
+       COUNT(*) AS runs,
+       SUM(num_prompts) AS prompts,
+       AVG(jb_percentage) AS jb_percentage,
+       AVG(mean_copy_jb_percentage) AS mean_copy_jb_percentage
+FROM runs
+WHERE finished_at IS NOT NULL
+GROUP BY target_model, attack, pert_type, pert_pct, num_copies
+ORDER BY target_model, attack, pert_type, pert_pct, num_copies
+'''
+
+class ResultsStore:
+
+    """SQLite results database shared by every run of a sweep."""
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+        # Prompts (with their copies) waiting to be written
+        self._pending = []
+        self._pending_copies = 0
+        self._lock = threading.Lock()
+
+    def _migrate(self):
+        with self.conn:
+            for table, column, column_type in MIGRATIONS:
+                columns = [row['name'] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+                if column not in columns:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def start_run(self, config, user_prompt_used=False):
+        """Record a run from its argparse-style config dict and return its id."""
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                '''INSERT INTO runs
+                   (created_at, target_model, attack, attack_logfile, pert_type, pert_pct,
+                    num_copies, trial, user_prompt_used, config)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (
+                    time.time(),
+                    config.get('target_model'),
+                    config.get('attack'),
+                    config.get('attack_logfile'),
+                    config.get('smoothllm_pert_type'),
+                    config.get('smoothllm_pert_pct'),
+                    config.get('smoothllm_num_copies'),
+                    config.get('trial'),
+                    int(user_prompt_used),
+                    json.dumps(config, default=str)
+                )
+            )
+        return cursor.lastrowid
+
+    def add_prompt(self, run_id, prompt_index, prompt, result, elapsed_seconds=None):
+        """Buffer one prompt's SmoothLLMResult and copies; flushed in batches."""
+        ci_lower, ci_upper = result.confidence_interval
+        row = (
+            run_id, prompt_index, prompt.perturbable_prompt, prompt.full_prompt,
+            prompt.max_new_tokens, int(result.is_jailbroken), result.num_evaluated,
+            result.num_jailbroken, result.jb_percentage, ci_lower, ci_upper,
+            result.output, elapsed_seconds
+        )
+        copies = [
+            (copy_index, copy_input, output, int(verdict), generate_seconds, judge_seconds)
+            for copy_index, (copy_input, output, verdict, generate_seconds, judge_seconds)
+            in enumerate(zip(
+                result.inputs, result.outputs, result.verdicts,
+                result.generate_seconds, result.judge_seconds
+            ))
+        ]
+        with self._lock:
+            self._pending.append((row, copies))
+            self._pending_copies += len(copies) + 1
+            full = self._pending_copies >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write buffered prompts and copies in one transaction."""
+        with self._lock:
+            pending, self._pending, self._pending_copies = self._pending, [], 0
+            if not pending:
+                return
+            with self.conn:
+                for row, copies in pending:
+                    prompt_id = self.conn.execute(INSERT_PROMPT_SQL, row).lastrowid
+                    self.conn.executemany(
+                        INSERT_COPY_SQL,
+                        [(prompt_id,) + copy_row for copy_row in copies]
+                    )
+
+    def finish_run(self, run_id):
+        """Flush the run's rows and store its summary."""
+        self.flush()
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE runs SET finished_at = ? WHERE id = ?', (time.time(), run_id))
+            self.conn.execute(UPDATE_RUN_SUMMARY_SQL, (run_id,) * 4)
+
+    def iter_copies(self, run_ids=None, chunk_size=10000):
+        """Yield lists of (copy_id, prompt_id, original_prompt, output, verdict) rows.
+
+        Reads through a separate connection, so verdicts can be updated
+        while the copies are streamed.
+        """
+        self.flush()
+        query = '''SELECT c.id, c.prompt_id, p.original_prompt, c.output, c.verdict
+                   FROM copies c JOIN prompts p ON p.id = c.prompt_id'''
+        params = ()
+        if run_ids:
+            query += f" WHERE p.run_id IN ({', '.join('?' * len(run_ids))})"
+            params = tuple(run_ids)
+        reader = sqlite3.connect(self.path)
+        try:
+            cursor = reader.execute(query + ' ORDER BY c.id', params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            reader.close()
+
+    def update_copy_verdicts(self, copy_verdicts):
+        """Overwrite stored copy verdicts from (verdict, copy_id) pairs."""
+        with self._lock, self.conn:
+            self.conn.executemany('UPDATE copies SET verdict = ? WHERE id = ?', copy_verdicts)
+
+    def update_prompt_votes(self, prompt_votes):
+        """Overwrite prompt votes and recompute the summaries of their runs.
+
+        `prompt_votes` holds (is_jailbroken, num_jailbroken, jb_percentage,
+        ci_lower, ci_upper, prompt_id) tuples. Copy verdicts must already be
+        updated: a prompt whose response no longer agrees with its vote gets
+        a copy output from the new majority, as SmoothLLMResult.finalize picks.
+        """
+        with self._lock, self.conn:
+            self.conn.executemany(
+                '''UPDATE prompts SET is_jailbroken = ?, num_jailbroken = ?, jb_percentage = ?,
+                       ci_lower = ?, ci_upper = ?
+                   WHERE id = ?''',
+                prompt_votes
+            )
+            self.conn.executemany(UPDATE_MAJORITY_OUTPUT_SQL, [(vote[-1],) for vote in prompt_votes])
+            prompt_ids = sorted({vote[-1] for vote in prompt_votes})
+            run_ids = set()
+            for start in range(0, len(prompt_ids), MAX_QUERY_PARAMS):
+                chunk = prompt_ids[start:start + MAX_QUERY_PARAMS]
+                run_ids.update(row[0] for row in self.conn.execute(
+                    f"SELECT DISTINCT run_id FROM prompts WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ))
+            for run_id in run_ids:
+                self.conn.execute(UPDATE_RUN_SUMMARY_SQL, (run_id,) * 4)
+
+    def sweep_summary(self):
+        """Mean jailbreak percentages per configuration across finished runs."""
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(SWEEP_SUMMARY_SQL)]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
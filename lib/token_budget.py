@@ -0,0 +1,122 @@
+"""
+Token budgets for SmoothLLM generations.
+
+The keyword judge only needs enough of a response to see whether it starts
+with a refusal, so generating the attack's full max_new_tokens for every
+copy is mostly wasted. A TokenBudgetPolicy generates in escalating chunks:
+a first chunk of `budget()` tokens, then `growth` times as many, up to the
+prompt's max_new_tokens, and only for copies whose verdict is still open.
+
+A verdict is final once a refusal has been generated (the judge can no
+longer call the copy jailbroken) or the model emitted EOS. The number of
+tokens each resolved copy needed is recorded, and once enough have been
+seen the first chunk is the `quantile` of those counts. Worker processes
+learn on a copy of the policy and send their observations back to be merged.
+Observations can be saved per judge and loaded in later runs:
+
+    policy = TokenBudgetPolicy.load('token_budgets.json', judge='keyword')
+    defense = SmoothLLM(..., token_budget=policy)
+    ...
+    policy.save('token_budgets.json')
+"""
+
+import json
+import math
+import os
+import threading
+from collections import deque
+
+class TokenBudgetPolicy:
+
+    """Escalating per-copy token budgets, learned from resolved verdicts."""
+
+    def __init__(
+        self,
+        initial_tokens=32,
+        min_tokens=8,
+        growth=2.0,
+        quantile=0.9,
+        min_observations=20,
+        max_observations=1000,
+        judge='keyword'
+    ):
+        if growth <= 1:
+            raise ValueError("growth must be greater than 1")
+        self.initial_tokens = initial_tokens
+        self.min_tokens = min_tokens
+        self.growth = growth
+        self.quantile = quantile
+        self.min_observations = min_observations
+        self.judge = judge
+        self.observations = deque(maxlen=max_observations)
+        # Observations recorded by observe() over this policy's lifetime
+        self.num_observed = 0
+        self._lock = threading.Lock()
+
+    def budget(self):
+        """Tokens to generate in the first chunk."""
+        with self._lock:
+            observed = sorted(self.observations)
+        if len(observed) < self.min_observations:
+            return self.initial_tokens
+        rank = min(len(observed) - 1, math.ceil(self.quantile * len(observed)) - 1)
+        return max(self.min_tokens, observed[rank])
+
+    def schedule(self, max_new_tokens):
+        """Cumulative token budgets for each chunk, ending at max_new_tokens."""
+        budgets = []
+        budget = min(self.budget(), max_new_tokens)
+        while budget < max_new_tokens:
+            budgets.append(budget)
+            budget = max(budget + 1, int(budget * self.growth))
+        budgets.append(max_new_tokens)
+        return budgets
+
+    def observe(self, tokens):
+        """Record the number of generated tokens a copy needed to resolve its verdict."""
+        with self._lock:
+            self.observations.append(tokens)
+            self.num_observed += 1
+
+    def observations_since(self, count):
+        """Observations recorded after the first `count` (as far as they are kept), and the new count."""
+        with self._lock:
+            new = min(self.num_observed - count, len(self.observations))
+            recent = list(self.observations)[len(self.observations) - new:]
+            return recent, self.num_observed
+
+    def merge(self, observations):
+        """Add observations recorded by another copy of this policy, e.g. in a worker process."""
+        with self._lock:
+            self.observations.extend(observations)
+
+    def __getstate__(self):
+        # Locks cannot be pickled; worker processes get a policy of their own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def save(self, path):
+        """Store this judge's observations, keeping other judges' entries in the file."""
+        data = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+        with self._lock:
+            data[self.judge] = list(self.observations)
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        return path
+
+    @classmethod
+    def load(cls, path, judge='keyword', **kwargs):
+        """Policy seeded with the observations stored for `judge`, if any."""
+        policy = cls(judge=judge, **kwargs)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                policy.observations.extend(json.load(f).get(judge, []))
+        return policy
@@ -6,8 +6,10 @@ from tqdm.auto import tqdm
 import argparse
 import json
 import copy
+import functools
 import random
 import string
+import time
 
 import lib.perturbations as perturbations
 import lib.defenses as defenses
@@ -15,60 +17,51 @@ import lib.attacks as attacks
 from lib.attacks import CustomPromptAttack
 import lib.language_models as language_models
 import lib.model_configs as model_configs
+import lib.profiling as profiling
+import lib.parallel as parallel
+from lib.token_budget import TokenBudgetPolicy
+from lib.results_store import ResultsStore
+from lib.daemon_client import DaemonClient
 
 def main(args):
 
     # Create output directories
     os.makedirs(args.results_dir, exist_ok=True)
     
-    # Instantiate the targeted LLM
-    config = model_configs.MODELS[args.target_model]
+    # Instantiate the targeted LLM, unless a daemon already holds it
     device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
-    print(f"Using device: {device}")
-    target_model = language_models.LLM(
-        model_path=config['model_path'],
-        tokenizer_path=config['tokenizer_path'],
-        conv_template_name=config['conversation_template'],
-        device=device
-    )
+    assisted = assisted_decoding_config(args)
+    client = None
+    target_model = None
+    if args.daemon_socket:
+        client = DaemonClient(args.daemon_socket)
+        print(f"Using SmoothLLM daemon at {args.daemon_socket}")
+    else:
+        print(f"Using device: {device}")
+        target_model = language_models.load_target_model(args.target_model, device, assisted, do_sample=not args.greedy)
 
-    # Track if user prompt was used
-    user_prompt_used = False
-    
-    # Create attack instance, used to create prompts
+    # Pick the prompt: custom user prompt, or prompts from the attack logfile
+    user_prompt = None
     if args.user_prompt:
         # Use custom user prompt
         print(f"Using custom user prompt: {args.user_prompt}")
-        attack = CustomPromptAttack(
-            user_prompt=args.user_prompt,
-            target_model=target_model
-        )
-        user_prompt_used = True
+        user_prompt = args.user_prompt
     else:
         # Check if user wants to input a prompt interactively
         try:
             user_input = input("\nEnter a custom prompt (or press Enter to use default attack): ").strip()
             if user_input:
                 print(f"Using interactive user prompt: {user_input}")
-                attack = CustomPromptAttack(
-                    user_prompt=user_input,
-                    target_model=target_model
-                )
-                user_prompt_used = True
+                user_prompt = user_input
             else:
-                # Use existing attack from logfile
                 print(f"Using default attack: {args.attack}")
-                attack = vars(attacks)[args.attack](
-                    logfile=args.attack_logfile,
-                    target_model=target_model
-                )
         except (EOFError, KeyboardInterrupt):
             # Handle case where input is not available (e.g., in scripts)
             print(f"Using default attack: {args.attack}")
-            attack = vars(attacks)[args.attack](
-                logfile=args.attack_logfile,
-                target_model=target_model
-            )
+
+    # Track if user prompt was used
+    user_prompt_used = user_prompt is not None
+    prompts = load_prompts(args, target_model, user_prompt, client)
 
     # Ask user for number of copies after prompt is set
     try:
@@ -79,40 +72,163 @@ def main(args):
     except (EOFError, KeyboardInterrupt, ValueError):
         print(f"Using default number of copies: {args.smoothllm_num_copies}")
     
-    # Update the defense with new number of copies
-    defense = defenses.SmoothLLM(
-        target_model=target_model,
-        pert_type=args.smoothllm_pert_type,
-        pert_pct=args.smoothllm_pert_pct,
-        num_copies=args.smoothllm_num_copies
-    )
+    token_budget = None
+    if args.token_budget:
+        # Generate in escalating chunks, starting from a learned or configured budget
+        if args.token_budget_file:
+            token_budget = TokenBudgetPolicy.load(args.token_budget_file, initial_tokens=args.token_budget)
+        else:
+            token_budget = TokenBudgetPolicy(initial_tokens=args.token_budget)
+        print(f"Token budget: first chunk of {token_budget.budget()} tokens")
+
+    if client is not None:
+        # Each prompt is one daemon request, so results stream in as they finish
+        options = {
+            'pert_type': args.smoothllm_pert_type,
+            'pert_pct': args.smoothllm_pert_pct,
+            'num_copies': args.smoothllm_num_copies,
+            'alphabet': args.smoothllm_pert_alphabet,
+            'stop_when_decided': args.stop_when_decided
+        }
+        results = (
+            defenses.SmoothLLMResult.from_dict(
+                client.evaluate(
+                    args.target_model,
+                    [(prompt.prefix, prompt.perturbable_prompt, prompt.suffix, prompt.max_new_tokens)],
+                    **options
+                )[0]
+            )
+            for prompt in prompts
+        )
+    elif args.num_workers > 1:
+        # Each worker process loads its own replica of the target model
+        evaluator = parallel.ParallelSmoothLLM(
+            model_factory=functools.partial(
+                language_models.load_target_model, args.target_model, device, assisted,
+                do_sample=not args.greedy
+            ),
+            pert_type=args.smoothllm_pert_type,
+            pert_pct=args.smoothllm_pert_pct,
+            num_copies=args.smoothllm_num_copies,
+            num_workers=args.num_workers,
+            threads_per_worker=args.threads_per_worker,
+            token_budget=token_budget,
+            alphabet=args.smoothllm_pert_alphabet
+        )
+        with evaluator:
+            # Spread copies over the workers when there are too few prompts to go round
+            results = evaluator.evaluate(
+                prompts,
+                stop_when_decided=args.stop_when_decided,
+                split_copies=len(prompts) < args.num_workers
+            )
+    else:
+        # Update the defense with new number of copies
+        defense = defenses.SmoothLLM(
+            target_model=target_model,
+            pert_type=args.smoothllm_pert_type,
+            pert_pct=args.smoothllm_pert_pct,
+            num_copies=args.smoothllm_num_copies,
+            token_budget=token_budget,
+            alphabet=args.smoothllm_pert_alphabet
+        )
+        results = (
+            evaluate_prompt(defense, prompt, i, args)
+            for i, prompt in enumerate(prompts)
+        )
+
+    # Every run of a sweep appends to the same results database
+    store = ResultsStore(args.results_db or os.path.join(args.results_dir, 'results.db'))
+    run_id = store.start_run(vars(args), user_prompt_used=user_prompt_used)
 
     jailbroken_results = []
-    for i, prompt in tqdm(enumerate(attack.prompts[:5])):
-        # Set the original prompt for context in jailbreak detection
-        defense.set_original_prompt(prompt.perturbable_prompt)
-        output = defense(prompt)
-        jb = defense.is_jailbroken(output)
+    copy_jb_percentages = []
+    last = time.perf_counter()
+    for i, result in tqdm(enumerate(results)):
+        # Per-prompt timings are only meaningful when prompts are evaluated one by one
+        elapsed = time.perf_counter() - last if args.num_workers <= 1 else None
+        store.add_prompt(run_id, i, prompts[i], result, elapsed)
+        jb = result.is_jailbroken
         jailbroken_results.append(jb)
-        print(f"Prompt {i}: {'unsafe' if jb else 'safe'}")
+        copy_jb_percentages.append(result.jb_percentage)
+        ci_lower, ci_upper = result.confidence_interval
+        print(
+            f"Prompt {i}: {'unsafe' if jb else 'safe'} "
+            f"({result.num_jailbroken}/{result.num_evaluated} copies jailbroken, "
+            f"{result.confidence:.0%} CI [{ci_lower:.2f}, {ci_upper:.2f}])"
+        )
+        last = time.perf_counter()
+
+    store.finish_run(run_id)
+    store.close()
+    if client is not None:
+        client.close()
+
+    if token_budget is not None and args.token_budget_file:
+        token_budget.save(args.token_budget_file)
 
     print(f'Total prompts processed: {len(jailbroken_results)}')
     print(f'Jailbreak success rate: {np.mean(jailbroken_results) * 100:.2f}%')
 
-    # Save results to a pandas DataFrame
+    # Summary of this run; per-prompt and per-copy results are in the results database
     summary_df = pd.DataFrame.from_dict({
         'Number of smoothing copies': [args.smoothllm_num_copies],
         'Perturbation type': [args.smoothllm_pert_type],
         'Perturbation percentage': [args.smoothllm_pert_pct],
         'JB percentage': [np.mean(jailbroken_results) * 100],
+        'Mean copy JB percentage': [np.mean(copy_jb_percentages) * 100],
         'Trial index': [args.trial],
         'User prompt used': [user_prompt_used]
     })
-    summary_df.to_pickle(os.path.join(
-        args.results_dir, 'summary.pd'
-    ))
     print(summary_df)
+    print(f"Results stored as run {run_id} in {store.path}")
+
+def assisted_decoding_config(args):
+    """Assisted decoding settings from the per-model config and command line."""
+    assisted = {}
+    if args.assisted_decoding:
+        assisted.update(model_configs.ASSISTED_DECODING.get(args.target_model, {}))
+    if args.assistant_model:
+        assisted = {'assistant_model': args.assistant_model}
+    if args.prompt_lookup_num_tokens:
+        assisted = {'prompt_lookup_num_tokens': args.prompt_lookup_num_tokens}
+    return assisted
+
+def load_prompts(args, target_model, user_prompt=None, client=None, limit=5):
+    """The custom prompt or the first `limit` attack prompts, built locally or by the daemon."""
+    if client is not None:
+        specs = client.build_prompts(
+            args.target_model,
+            attack=args.attack,
+            attack_logfile=args.attack_logfile,
+            user_prompt=user_prompt,
+            limit=limit
+        )
+        return [attacks.Prompt.from_parts(*spec) for spec in specs]
+    if user_prompt:
+        attack = CustomPromptAttack(
+            user_prompt=user_prompt,
+            target_model=target_model
+        )
+    else:
+        attack = vars(attacks)[args.attack](
+            logfile=args.attack_logfile,
+            target_model=target_model
+        )
+    return attack.prompts[:limit]
 
+def evaluate_prompt(defense, prompt, i, args):
+    # Set the original prompt for context in jailbreak detection
+    defense.set_original_prompt(prompt.perturbable_prompt)
+    if args.trace_dir:
+        # Record a Chrome trace of this evaluation
+        tracer = profiling.Tracer(name=f'prompt-{i}')
+        with tracer.activate():
+            result = defense(prompt, stop_when_decided=args.stop_when_decided)
+        trace_path = tracer.save(os.path.join(args.trace_dir, f'trace-prompt-{i}.json'))
+        print(f"Trace written to {trace_path}")
+        return result
+    return defense(prompt, stop_when_decided=args.stop_when_decided)
 
 if __name__ == '__main__':
     torch.cuda.empty_cache()
@@ -128,6 +244,12 @@ if __name__ == '__main__':
         type=int,
         default=0
     )
+    parser.add_argument(
+        '--results_db',
+        type=str,
+        default=None,
+        help='SQLite results database to append this run to (default: <results_dir>/results.db)'
+    )
 
     # Targeted LLM
     parser.add_argument(
@@ -147,7 +269,8 @@ if __name__ == '__main__':
     parser.add_argument(
         '--attack_logfile',
         type=str,
-        default='data/GCG/vicuna_behaviors.json'
+        default='data/GCG/vicuna_behaviors.json',
+        help='Attack log file, directory of shards, or glob pattern'
     )
 
     # SmoothLLM
@@ -165,11 +288,25 @@ if __name__ == '__main__':
         '--smoothllm_pert_type',
         type=str,
         default='RandomPatchPerturbation',
-        choices=[
-            'RandomSwapPerturbation',
-            'RandomPatchPerturbation',
-            'RandomInsertPerturbation'
-        ]
+        choices=list(perturbations.available_perturbations())
+    )
+
+    parser.add_argument(
+        '--smoothllm_pert_alphabet',
+        type=str,
+        default='printable',
+        choices=['printable', 'homoglyph', 'vocab'],
+        help="Characters perturbations draw from; 'vocab' uses pieces of the target model's vocabulary"
+    )
+    parser.add_argument(
+        '--greedy',
+        action='store_true',
+        help='Decode greedily instead of sampling; identical perturbed copies then share one generation'
+    )
+    parser.add_argument(
+        '--stop_when_decided',
+        action='store_true',
+        help='Stop generating copies once the confidence interval on the jailbreak rate excludes 50%%'
     )
 
     # User input prompt option
@@ -180,5 +317,81 @@ if __name__ == '__main__':
         help='Custom user prompt to test instead of using attack logfile'
     )
 
+    # Profiling
+    parser.add_argument(
+        '--trace_dir',
+        type=str,
+        default=None,
+        help='Write a Chrome trace-event JSON file per evaluated prompt to this directory'
+    )
+
+    # Adaptive generation length
+    parser.add_argument(
+        '--token_budget',
+        type=int,
+        default=None,
+        help='Generate in escalating chunks starting at this many tokens, continuing only copies whose verdict is still open'
+    )
+    parser.add_argument(
+        '--token_budget_file',
+        type=str,
+        default=None,
+        help='JSON file of token counts that resolved past verdicts; the first chunk is learned from it and it is updated after the run'
+    )
+
+    # Assisted decoding
+    parser.add_argument(
+        '--assisted_decoding',
+        action='store_true',
+        help='Use the assisted decoding settings for the target model in model_configs.ASSISTED_DECODING'
+    )
+    parser.add_argument(
+        '--assistant_model',
+        type=str,
+        default=None,
+        choices=list(model_configs.MODELS),
+        help='Draft model that proposes tokens for the target model to verify'
+    )
+    parser.add_argument(
+        '--prompt_lookup_num_tokens',
+        type=int,
+        default=None,
+        help='Propose this many tokens by n-gram lookup in the prompt'
+    )
+
+    # Data-parallel evaluation
+    parser.add_argument(
+        '--num_workers',
+        type=int,
+        default=1,
+        help='Evaluate with this many worker processes, each with its own model replica pinned to a subset of CPU cores'
+    )
+    parser.add_argument(
+        '--threads_per_worker',
+        type=int,
+        default=None,
+        help='torch threads per worker (default: the number of cores the worker is pinned to)'
+    )
+
+    # Persistent inference daemon
+    parser.add_argument(
+        '--daemon_socket',
+        type=str,
+        default=None,
+        help='Evaluate on the models held by smoothllm_daemon.py at this Unix socket instead of loading one'
+    )
+
     args = parser.parse_args()
+    if args.assistant_model and args.prompt_lookup_num_tokens:
+        parser.error('--assistant_model and --prompt_lookup_num_tokens are mutually exclusive')
+    if args.num_workers > 1 and args.trace_dir:
+        parser.error('--trace_dir is not supported with --num_workers > 1')
+    if args.daemon_socket and (
+        args.num_workers > 1 or args.trace_dir or args.token_budget or args.greedy
+        or args.assisted_decoding or args.assistant_model or args.prompt_lookup_num_tokens
+    ):
+        parser.error(
+            '--daemon_socket cannot be combined with --num_workers, --trace_dir, --token_budget, '
+            '--greedy or assisted decoding; decoding is configured when the daemon starts'
+        )
     main(args)
\ No newline at end of file
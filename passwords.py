@@ -0,0 +1,129 @@
+"""
+Password hashing for the web app.
+
+Hashes are stored in a versioned, self-describing format so that cost
+parameters can be raised later without invalidating existing accounts:
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+Salts and hashes are URL-safe base64. Bare 64-character hex digests are the
+legacy unsalted SHA-256 format and are upgraded on the next successful login.
+
+KDF work runs in a small bounded thread pool (hashlib releases the GIL), so a
+burst of logins cannot occupy more than PASSWORD_HASH_WORKERS cores. The pool
+only limits CPU concurrency: hash_password and verify_password still block
+their caller until the KDF finishes, so a Flask request thread (or, under
+asgi.py, a thread of the WSGI pool; never the event loop) waits for it. Async
+code that must not wait can await the *_async futures with
+asyncio.wrap_future.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# scrypt is missing from hashlib when Python is built against an old OpenSSL
+DEFAULT_SCHEME = 'scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256'
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+
+# Hash of a random password with the current parameters, verified against when
+# an account does not exist so sign-in takes as long as for a wrong password
+_dummy_hash = None
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem must cover 128 * n * r bytes plus some slack
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r + 1024 * 1024, dklen=KEY_BYTES
+    )
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=KEY_BYTES)
+
+def _hash(password, scheme=None):
+    """Compute a new salted hash in the versioned format."""
+    scheme = scheme or DEFAULT_SCHEME
+    salt = secrets.token_bytes(SALT_BYTES)
+    if scheme == 'scrypt':
+        key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+    if scheme == 'pbkdf2_sha256':
+        key = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64encode(salt)}${_b64encode(key)}"
+    raise ValueError(f"Unknown password hash scheme: {scheme}")
+
+def _verify(password, password_hash):
+    """Check a password against any supported hash format."""
+    if not password_hash:
+        return False
+    parts = password_hash.split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            key = _scrypt(password, _b64decode(parts[4]), n, r, p)
+            return hmac.compare_digest(key, _b64decode(parts[5]))
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            key = _pbkdf2(password, _b64decode(parts[2]), int(parts[1]))
+            return hmac.compare_digest(key, _b64decode(parts[3]))
+    except (ValueError, TypeError):
+        return False
+    if is_legacy_hash(password_hash):
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, password_hash)
+    return False
+
+def is_legacy_hash(password_hash):
+    """True for the original unsalted SHA-256 hex digests."""
+    return len(password_hash) == 64 and '$' not in password_hash
+
+def needs_rehash(password_hash):
+    """True if a stored hash uses a legacy format or outdated cost parameters."""
+    parts = password_hash.split('$')
+    if parts[0] != DEFAULT_SCHEME:
+        return True
+    if DEFAULT_SCHEME == 'scrypt':
+        return parts[1:4] != [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+    return parts[1] != str(PBKDF2_ITERATIONS)
+
+def hash_password_async(password):
+    """Submit hashing to the bounded pool; returns a concurrent.futures.Future."""
+    return _executor.submit(_hash, password)
+
+def verify_password_async(password, password_hash):
+    """Submit verification to the bounded pool; returns a concurrent.futures.Future."""
+    return _executor.submit(_verify, password, password_hash)
+
+def hash_password(password):
+    """Hash a password with the current default scheme; blocks until the pool has run it."""
+    return hash_password_async(password).result()
+
+def verify_password(password, password_hash):
+    """Verify a password against a stored hash of any supported version; blocks like hash_password."""
+    return verify_password_async(password, password_hash).result()
+
+def dummy_password_hash():
+    """Stand-in hash for unknown accounts; no password verifies against it."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_urlsafe(32))
+    return _dummy_hash
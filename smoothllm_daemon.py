@@ -0,0 +1,278 @@
+"""
+Long-lived SmoothLLM inference daemon.
+
+Keeps target models loaded and serves SmoothLLM evaluations over a Unix
+domain socket, so main.py, the web app and other short-lived tools do not
+pay for a model load on every invocation:
+
+    python smoothllm_daemon.py --socket /tmp/smoothllm.sock --models tinyllama
+    python main.py --daemon_socket /tmp/smoothllm.sock --user_prompt "..."
+    SMOOTHLLM_DAEMON_SOCKET=/tmp/smoothllm.sock python app.py
+
+Only the models named by --models (loaded at startup) and --allowed_models
+(loaded on first use) are served; requests for any other model are rejected
+before anything is loaded, since clients such as the web app pass a
+user-supplied model name through.
+
+Each connection is served by its own thread; evaluations on the same model
+are serialized, since one generate call already keeps the device busy. See
+lib/daemon_client.py for the wire protocol and the client.
+"""
+
+import argparse
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import torch
+
+import lib.attacks as attacks
+import lib.defenses as defenses
+import lib.language_models as language_models
+import lib.model_configs as model_configs
+from lib.daemon_client import DEFAULT_SOCKET, recv_message, send_message
+
+ATTACKS = ('GCG', 'PAIR')
+
+# SmoothLLM instances kept per (model, perturbation settings)
+MAX_CACHED_DEFENSES = 32
+
+class ModelPool:
+
+    """Loaded target models and their SmoothLLM defenses, with one lock per model."""
+
+    def __init__(self, device, allowed_models, do_sample=True, assisted=None):
+        self.device = device
+        self.allowed_models = frozenset(allowed_models)
+        self.do_sample = do_sample
+        self.assisted = assisted or {}
+        self._models = {}
+        self._locks = {}
+        self._defenses = {}
+        self._lock = threading.Lock()
+
+    def loaded(self):
+        with self._lock:
+            return sorted(self._models)
+
+    def model(self, name):
+        """The loaded model `name` and the lock that serializes its use."""
+        if name not in self.allowed_models:
+            raise ValueError(f"Model '{name}' is not served; available: {', '.join(sorted(self.allowed_models))}")
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._models:
+                start = time.perf_counter()
+                target_model = language_models.load_target_model(
+                    name, self.device, self.assisted, do_sample=self.do_sample
+                )
+                with self._lock:
+                    self._models[name] = target_model
+                print(f"Loaded {name} in {time.perf_counter() - start:.1f}s")
+        return self._models[name], lock
+
+    def defense(self, name, pert_type, pert_pct, num_copies, alphabet):
+        target_model, lock = self.model(name)
+        key = (name, pert_type, pert_pct, num_copies, alphabet)
+        with self._lock:
+            defense = self._defenses.get(key)
+        if defense is None:
+            defense = defenses.SmoothLLM(
+                target_model=target_model,
+                pert_type=pert_type,
+                pert_pct=pert_pct,
+                num_copies=num_copies,
+                alphabet=alphabet
+            )
+            with self._lock:
+                if len(self._defenses) >= MAX_CACHED_DEFENSES:
+                    self._defenses.clear()
+                self._defenses[key] = defense
+        return defense, lock
+
+class DaemonHandler(socketserver.BaseRequestHandler):
+
+    """Serves requests from one client connection until it closes."""
+
+    def handle(self):
+        while True:
+            try:
+                codec, message = recv_message(self.request)
+            except (ConnectionError, ValueError) as e:
+                print(f"Dropping connection: {e}")
+                return
+            if codec is None:
+                return
+            send_message(self.request, self.server.dispatch(message), codec)
+
+class SmoothLLMDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """Unix socket server answering SmoothLLM requests from a ModelPool."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool):
+        self.pool = pool
+        self.started = time.time()
+        super(SmoothLLMDaemon, self).__init__(socket_path, DaemonHandler)
+        # Only the owner may submit prompts
+        os.chmod(socket_path, 0o600)
+        self.ops = {
+            'ping': self.ping,
+            'prompts': self.build_prompts,
+            'evaluate': self.evaluate,
+            'analyze': self.analyze,
+            'shutdown': self.stop,
+        }
+
+    def dispatch(self, message):
+        op = message.pop('op', None)
+        if op not in self.ops:
+            return {'ok': False, 'error': f"Unknown op '{op}'"}
+        start = time.perf_counter()
+        try:
+            result = self.ops[op](**message)
+        except Exception as e:
+            print(f"Request {op} failed: {e!r}")
+            return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        print(f"Request {op} served in {time.perf_counter() - start:.3f}s")
+        return {'ok': True, 'result': result}
+
+    def ping(self):
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started,
+            'models': self.pool.loaded(),
+            'allowed_models': sorted(self.pool.allowed_models),
+        }
+
+    def build_prompts(self, model, attack='GCG', attack_logfile=None, user_prompt=None, limit=None):
+        target_model, _ = self.pool.model(model)
+        if user_prompt:
+            prompts = attacks.CustomPromptAttack(user_prompt=user_prompt, target_model=target_model).prompts
+        elif attack in ATTACKS:
+            prompts = vars(attacks)[attack](logfile=attack_logfile, target_model=target_model).prompts
+        else:
+            raise ValueError(f"Unknown attack '{attack}'; available: {', '.join(ATTACKS)}")
+        if limit is not None:
+            prompts = prompts[:limit]
+        return [[prompt.prefix, prompt.perturbable_prompt, prompt.suffix, prompt.max_new_tokens] for prompt in prompts]
+
+    def evaluate(
+        self,
+        model,
+        prompts,
+        pert_type='RandomPatchPerturbation',
+        pert_pct=10,
+        num_copies=10,
+        alphabet='printable',
+        batch_size=64,
+        stop_when_decided=False
+    ):
+        defense, lock = self.pool.defense(model, pert_type, int(pert_pct), int(num_copies), alphabet)
+        results = []
+        with lock:
+            for prefix, perturbable_prompt, suffix, max_new_tokens in prompts:
+                # Rebuilt from its parts, so the span is exactly the one the client built
+                prompt = attacks.Prompt.from_parts(prefix, perturbable_prompt, suffix, max_new_tokens)
+                defense.set_original_prompt(prompt.perturbable_prompt)
+                result = defense(prompt, batch_size=int(batch_size), stop_when_decided=stop_when_decided)
+                results.append(result.to_dict())
+        return results
+
+    def analyze(self, model, user_prompt, **options):
+        prompts = self.build_prompts(model, user_prompt=user_prompt)
+        return self.evaluate(model, prompts, **options)[0]
+
+    def stop(self):
+        # shutdown() waits for serve_forever, so it cannot run on a handler thread's stack
+        threading.Thread(target=self.shutdown, daemon=True).start()
+        return True
+
+def remove_stale_socket(socket_path):
+    """Delete a socket file left behind by a daemon that is no longer running."""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise SystemExit(f"A daemon is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+def main(args):
+
+    device = args.device or ('cuda:0' if torch.cuda.is_available() else 'cpu')
+    assisted = {}
+    if args.prompt_lookup_num_tokens:
+        assisted = {'prompt_lookup_num_tokens': args.prompt_lookup_num_tokens}
+    pool = ModelPool(device, args.models + args.allowed_models, do_sample=not args.greedy, assisted=assisted)
+    for name in args.models:
+        pool.model(name)
+
+    remove_stale_socket(args.socket)
+    server = SmoothLLMDaemon(args.socket, pool)
+    print(f"SmoothLLM daemon listening on {args.socket} (device {device}, pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        print("SmoothLLM daemon stopped")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=os.environ.get('SMOOTHLLM_DAEMON_SOCKET', DEFAULT_SOCKET)
+    )
+    parser.add_argument(
+        '--models',
+        type=str,
+        nargs='*',
+        default=[],
+        choices=list(model_configs.MODELS),
+        help='Models to load at startup'
+    )
+    parser.add_argument(
+        '--allowed_models',
+        type=str,
+        nargs='*',
+        default=[],
+        choices=list(model_configs.MODELS),
+        help='Further models to serve, loaded on first request; requests for unlisted models are rejected'
+    )
+    parser.add_argument(
+        '--device',
+        type=str,
+        default=None,
+        help='Default: cuda:0 if available, else cpu'
+    )
+    parser.add_argument(
+        '--greedy',
+        action='store_true',
+        help='Decode greedily instead of sampling'
+    )
+    parser.add_argument(
+        '--prompt_lookup_num_tokens',
+        type=int,
+        default=None,
+        help='Use prompt lookup decoding with this many candidate tokens'
+    )
+
+    args = parser.parse_args()
+    if not args.models and not args.allowed_models:
+        parser.error('Serve at least one model with --models or --allowed_models')
+    main(args)
@@ -0,0 +1,37 @@
+import argparse
+
+import pandas as pd
+
+from lib.results_store import ResultsStore
+
+def main(args):
+
+    with ResultsStore(args.results_db) as store:
+        summary_df = pd.DataFrame(store.sweep_summary())
+
+    if summary_df.empty:
+        print(f"No finished runs in {args.results_db}")
+        return
+    print(summary_df.to_string(index=False))
+    if args.output:
+        summary_df.to_csv(args.output, index=False)
+        print(f"Summary written to {args.output}")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--results_db',
+        type=str,
+        default='./results/results.db'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Also write the summary as CSV to this path'
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -10,6 +10,7 @@ num_copies=(10)
 trials=(1)
 target_model=vicuna
 results_root=./results
+results_db=$results_root/results.db
 
 for trial in "${trials[@]}"; do
     for type in "${types[@]}"; do
@@ -27,10 +28,13 @@ for trial in "${trials[@]}"; do
                     --smoothllm_pert_type $type \
                     --smoothllm_pert_pct $pct \
                     --smoothllm_num_copies $n \
-                    --trial $trial
+                    --trial $trial \
+                    --results_db $results_db
 
             done     
         done
     done
 done
-                
\ No newline at end of file
+                
+
+python summarize.py --results_db $results_db